@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.handlers import asgi
+from django.db import close_old_connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+ASYNC_VIEWS = getattr(settings, "ASYNC_VIEWS", {})
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_VIEWS.get("THREADS", 16), thread_name_prefix="async-view")
+
+# parts of a streamed body produced ahead of the client
+_STREAM_AHEAD = 8
+_END = object()
+
+
+def _run(view, request, *args, **kwargs):
+    """
+    Runs a sync DRF view on an executor thread, that thread owns its database connection.
+    Streamed bodies are produced later, by ASGIHandler.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, "render") and not response.streaming:
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+class AsyncAPIViewMixin:
+    """
+    Serves an APIView as an async view when ASYNC_VIEWS["ENABLED"] is set (nurserymarket.asgi sets it).
+    Django 3.1 has no async ORM, so the view body runs on a bounded thread pool of ASYNC_VIEWS["THREADS"]
+    threads instead of the single thread Django gives sync views under ASGI; the event loop only holds the
+    client connection. Under WSGI the view is served as before.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        if not ASYNC_VIEWS.get("ENABLED"):
+            return view
+
+        async def async_view(request, *args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # run_in_executor doesn't carry context variables over (common_utils.timing needs them), copy them
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(
+                _executor, functools.partial(context.run, _run, view, request, *args, **kwargs)
+            )
+
+        # name, module and the view_class / initkwargs / csrf_exempt attributes of the DRF view
+        return functools.update_wrapper(async_view, view)
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoiseMiddleware that also runs async. The stock one is sync only, under ASGI that sends every request
+    through Django's one thread for sync code, one request at a time.
+    Files are looked up in the table built at startup (on disk only with autorefresh, i.e. DEBUG) and served
+    as a streamed body, which ASGIHandler reads on a thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        self._async = asyncio.iscoroutinefunction(get_response)
+        if self._async:
+            # how Django's MiddlewareMixin tells the handler this instance is a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self._async:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+def _produce(response, loop, parts, stop):
+    """iterates a streamed body on an executor thread, the iterator may use the ORM; ends with _END"""
+    close_old_connections()
+    try:
+        for part in response:
+            asyncio.run_coroutine_threadsafe(parts.put(part), loop).result()
+            if stop.is_set():
+                break
+    except Exception as e:
+        asyncio.run_coroutine_threadsafe(parts.put(e), loop).result()
+    finally:
+        # request_finished (close_old_connections among others) runs on the thread that used the connection
+        response.close()
+        asyncio.run_coroutine_threadsafe(parts.put(_END), loop).result()
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGI handler iterates streamed bodies on the event loop, where the ORM refuses to run and the
+    blocking reads of every other request would wait. This one produces them on the async view pool and sends
+    each part as it is ready, up to _STREAM_AHEAD parts ahead of the client.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        # status, headers and cookies as Django's send_response sends them
+        headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            headers.append((bytes(header), bytes(value)))
+        for cookie in response.cookies.values():
+            headers.append((b"Set-Cookie", cookie.output(header="").encode("ascii").strip()))
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+
+        loop = asyncio.get_running_loop()
+        parts, stop = asyncio.Queue(_STREAM_AHEAD), threading.Event()
+        producing = loop.run_in_executor(_executor, _produce, response, loop, parts, stop)
+        part = None
+        try:
+            while True:
+                part = await parts.get()
+                if part is _END:
+                    break
+                if isinstance(part, Exception):
+                    raise part
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body"})
+        finally:
+            # on errors or a client gone away the producer stops after its next part, take parts until it is done
+            stop.set()
+            while part is not _END:
+                part = await parts.get()
+            await producing
+
+
+def get_asgi_application():
+    """django.core.asgi.get_asgi_application with ASGIHandler, for nurserymarket.asgi"""
+    django.setup(set_prefix=False)
+    return ASGIHandler()
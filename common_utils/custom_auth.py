@@ -1,4 +1,10 @@
+import copy
+import hashlib
 import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
 import jwt
 from django.conf import settings
@@ -6,9 +12,126 @@ from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, requ
 from rest_framework import exceptions, status
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
 
+from common_utils.metrics import count_auth, count_cache
+from common_utils.revocation import revocations
+from common_utils.shared_cache import saves_queries, shared_cache
+from common_utils.timing import timed
 from user_management.models import Buyer, Nursery
 
 
+class TokenUser:
+    """
+    Principal built from the claims of a stateless token, no database row behind it.
+    Carries only what the views and permission classes read: id, IsBuyer and IsNursery.
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, user_type, IsBuyer=False, IsNursery=False):
+        self.id = uuid.UUID(str(user_id))
+        self.user_type = user_type
+        self.IsBuyer = IsBuyer
+        self.IsNursery = IsNursery
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return f"{self.user_type}:{self.id}"
+
+
+class PrincipalCache:
+    """
+    Process wide LRU cache of verified principals, keyed by the sha256 digest of the raw token.
+    Entries expire after `ttl` seconds or at the token's own exp, whichever comes first. Callers get a copy, never
+    the cached instance.
+    invalidate() drops a user's entries in this process. With a shared cache that saves queries
+    (common_utils.shared_cache) it also bumps the user's generation there, which every process checks on a hit;
+    otherwise the other processes keep a changed user for up to `ttl` seconds. Deleted users are rejected through
+    common_utils.revocation either way.
+    """
+
+    def __init__(self, ttl=60, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # digest -> (user, expires_at, generation)
+        self._by_user = {}  # user id -> set of digests
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(token):
+        if isinstance(token, str):
+            token = token.encode("utf-8")
+        return hashlib.sha256(token).hexdigest()
+
+    @staticmethod
+    def _user_key(user_id):
+        return str(uuid.UUID(str(user_id)))
+
+    @staticmethod
+    def _generation_key(user_key):
+        return f"auth:principal:{user_key}"
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            user, expires_at, generation = entry
+            if expires_at <= time.time():
+                self._discard(digest)
+                return None
+            self._entries.move_to_end(digest)
+        if saves_queries() and shared_cache().get(self._generation_key(self._user_key(user.pk))) != generation:
+            # invalidated by another process
+            with self._lock:
+                if self._entries.get(digest) is entry:
+                    self._discard(digest)
+            return None
+        return copy.copy(user)
+
+    def set(self, digest, user, token_exp=None):
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        user_key = self._user_key(user.pk)
+        generation = shared_cache().get(self._generation_key(user_key)) if saves_queries() else None
+        with self._lock:
+            self._entries[digest] = (copy.copy(user), expires_at, generation)
+            self._entries.move_to_end(digest)
+            self._by_user.setdefault(user_key, set()).add(digest)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, user_id):
+        user_key = self._user_key(user_id)
+        if saves_queries():
+            # outlives every entry cached under the old generation
+            shared_cache().set(self._generation_key(user_key), uuid.uuid4().hex, timeout=self.ttl)
+        with self._lock:
+            for digest in self._by_user.pop(user_key, ()):
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def _discard(self, digest):
+        user, _, _ = self._entries.pop(digest)
+        digests = self._by_user.get(self._user_key(user.pk))
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[self._user_key(user.pk)]
+
+
+_cache_conf = getattr(settings, "AUTH_PRINCIPAL_CACHE", {})
+principal_cache = PrincipalCache(ttl=_cache_conf.get("TTL", 60), max_size=_cache_conf.get("MAX_SIZE", 10000))
+
+
 class TokenAuthentication(BaseAuthentication):
     model = None
 
@@ -17,7 +140,16 @@ class TokenAuthentication(BaseAuthentication):
         return model[user_type]
 
     def authenticate(self, request):
-
+        with timed("auth"):
+            try:
+                result = self._authenticate(request)
+            except exceptions.AuthenticationFailed:
+                count_auth("token", "failed")
+                raise
+        count_auth("token", "ok")
+        return result
+
+    def _authenticate(self, request):
         auth = get_authorization_header(request).split()
         if not auth or auth[0].lower() != b"bearer":
             msg = "Invalid token header."
@@ -44,18 +176,28 @@ class TokenAuthentication(BaseAuthentication):
         return self.authenticate_credentials(token)
 
     def authenticate_credentials(self, token):
+        digest = principal_cache.digest(token)
+        user = principal_cache.get(digest)
+        count_cache("principal", user is not None)
+        if user is not None:
+            self.check_revoked(user)
+            return (user, None)
 
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
             userid = payload["user_id"]
             model = self.get_model(payload["user_type"])
 
-            try:
-                user = Buyer.objects.get(id=userid)
-            except Buyer.DoesNotExist:
-                user = Nursery.objects.get(id=userid)
-            except Nursery.DoesNotExist:
-                raise exceptions.AuthenticationFailed({"error": "invalid_User_Token"})
+            if settings.JWT_AUTH.get("STATELESS") and "IsBuyer" in payload and "IsNursery" in payload:
+                user = TokenUser(userid, payload["user_type"], payload["IsBuyer"], payload["IsNursery"])
+                self.check_revoked(user)
+            else:
+                try:
+                    user = model.objects.get(id=userid)
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed({"error": "invalid_User_Token"})
+                if user.isdeleted:
+                    raise exceptions.AuthenticationFailed({"error": "invalid_User_Token"})
 
         except jwt.exceptions.DecodeError:
             raise exceptions.AuthenticationFailed({"error": "Invalid_Token"})
@@ -70,11 +212,19 @@ class TokenAuthentication(BaseAuthentication):
         except jwt.exceptions.InvalidTokenError:
             raise exceptions.AuthenticationFailed({"error": "Invalid_Token_Error"})
 
+        except exceptions.AuthenticationFailed:
+            raise
         except Exception as e:
             raise exceptions.AuthenticationFailed({"error": e.args})
 
+        principal_cache.set(digest, user, token_exp=payload.get("exp"))
         return (user, None)
 
+    def check_revoked(self, user):
+        # cached principals too: a user deleted in another process is in its cache until the entry expires
+        if revocations.is_revoked(user.id):
+            raise exceptions.AuthenticationFailed({"error": "invalid_User_Token"})
+
     def authenticate_header(self, request):
         return "Token"
 
@@ -85,5 +235,9 @@ def generate_token(id, user_type):
         "user_type": user_type,
         "exp": settings.JWT_AUTH["JWT_EXPIRATION_DELTA"],
     }
+    if settings.JWT_AUTH.get("STATELESS"):
+        # claims read by IsBuyerUser / IsNurseryUser, lets TokenAuthentication skip the user lookup
+        payload["IsBuyer"] = user_type == "buyer"
+        payload["IsNursery"] = user_type == "nursery"
     jwt_token = jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
     return jwt_token
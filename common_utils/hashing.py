@@ -0,0 +1,106 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.crypto import get_random_string
+
+from common_utils.metrics import count_auth
+from common_utils.shared_cache import saves_queries, shared_cache
+
+PASSWORD_HASHING = getattr(settings, "PASSWORD_HASHING", {})
+UNKNOWN_EMAIL_TTL = PASSWORD_HASHING.get("UNKNOWN_EMAIL_TTL", 300)
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class PasswordHasherPool:
+    """
+    Runs password hashing on `workers` dedicated threads (PBKDF2 releases the GIL), so a burst of logins
+    uses at most that many cores. Up to `max_queue` more requests wait for a thread; anything beyond that,
+    or waiting longer than `timeout` seconds, fails right away with HashingBusy instead of piling up.
+    """
+
+    def __init__(self, workers=2, max_queue=16, timeout=10):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._dummy = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy("Too many requests, try again shortly.")
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy("Too many requests, try again shortly.")
+
+    def make_password(self, password):
+        return self._run(hashers.make_password, password)
+
+    def check_password(self, password, encoded):
+        return self._run(hashers.check_password, password, encoded)
+
+    def dummy_check(self, password):
+        """same cost as a real check_password, for logins that have no user to check against"""
+        if self._dummy is None:
+            self._dummy = self.make_password(get_random_string(16))
+        self.check_password(password, self._dummy)
+
+
+password_hasher = PasswordHasherPool(
+    workers=PASSWORD_HASHING.get("WORKERS", 2),
+    max_queue=PASSWORD_HASHING.get("MAX_QUEUE", 16),
+    timeout=PASSWORD_HASHING.get("TIMEOUT", 10),
+)
+
+
+def _unknown_email_key(model, email):
+    digest = hashlib.md5(str(email).encode("utf-8")).hexdigest()
+    return f"auth:unknown:{model._meta.label_lower}:{digest}"
+
+
+def forget_unknown_email(model, email):
+    """call once an account with `email` exists"""
+    if saves_queries():
+        shared_cache().delete(_unknown_email_key(model, email))
+
+
+def authenticate(model, email, password):
+    """
+    returns the user when the password matches, None when it doesn't.
+    Raises model.DoesNotExist for unknown or deleted emails, after the same hashing work as a real check.
+    Unknown emails are remembered for UNKNOWN_EMAIL_TTL seconds so repeats skip the database, when the shared cache
+    is a store other than the database.
+    """
+    # the entry has to reach every worker, or the others refuse a new account for UNKNOWN_EMAIL_TTL; and in the
+    # database cache table a lookup costs the same query as looking for the user
+    remember = saves_queries()
+    key = _unknown_email_key(model, email)
+    user = None
+    if not remember or shared_cache().get(key) is None:
+        user = model.objects.exclude(isdeleted=True).filter(email=email).first()
+        if user is None and remember:
+            shared_cache().set(key, True, UNKNOWN_EMAIL_TTL)
+    try:
+        if user is None:
+            password_hasher.dummy_check(password)
+            count_auth("login", "unknown_user")
+            raise model.DoesNotExist
+        if password_hasher.check_password(password, user.password):
+            count_auth("login", "ok")
+            return user
+    except HashingBusy:
+        count_auth("login", "busy")
+        raise
+    count_auth("login", "failed")
+    return None
@@ -0,0 +1,130 @@
+"""
+Prometheus metrics: request latency and database time per view, method and status, cache hits, auth outcomes and
+the database connection pools.
+Served in the Prometheus text format by metrics_view.
+
+With several worker processes (gunicorn) set METRICS["MULTIPROCESS_DIR"] to an empty directory shared by the
+workers: each process writes its samples to memory mapped files there and a scrape of any worker adds up all of
+them. gunicorn.conf.py removes the files of workers that exit.
+"""
+import os
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+METRICS = getattr(settings, "METRICS", {})
+ENABLED = METRICS.get("ENABLED", False)
+MULTIPROCESS_DIR = METRICS.get("MULTIPROCESS_DIR")
+
+if MULTIPROCESS_DIR:
+    # prometheus_client picks its storage from this variable when first imported
+    os.environ.setdefault("prometheus_multiproc_dir", MULTIPROCESS_DIR)
+
+from prometheus_client import (  # noqa: E402
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time to produce a response", ("view", "method", "status"))
+REQUEST_DB_TIME = Histogram("http_request_db_seconds", "Database time per request", ("view", "method"))
+REQUEST_QUERIES = Counter("http_request_db_queries", "Database queries run by requests", ("view", "method"))
+CACHE_REQUESTS = Counter("cache_requests", "Cache lookups", ("cache", "result"))
+AUTH_ATTEMPTS = Counter("auth_attempts", "Authentication attempts", ("kind", "outcome"))
+# common_utils.pooled_postgresql, summed over the worker processes. Saturation:
+# sum(db_pool_connections{state="in_use"}) / sum(db_pool_max_size)
+DB_POOL_MAX_SIZE = Gauge("db_pool_max_size", "Connections the pool may open", ("alias",), multiprocess_mode="livesum")
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Pooled connections in use or idle", ("alias", "state"), multiprocess_mode="livesum"
+)
+DB_POOL_EVENTS = Counter(
+    "db_pool_events",
+    "Pool connections created, reused, discarded or health checked, and checkouts timed out",
+    ("alias", "event"),
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time a checkout waited for a free connection",
+    ("alias",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+)
+
+
+# labels() costs more than the observation itself, so the children of each view / method / status are kept
+_request_children = {}
+
+
+def observe_request(view, method, status, seconds, timings):
+    """`view` is the resolved view name, None for unrouted requests which are counted together"""
+    if not ENABLED:
+        return
+    key = (view, method, status)
+    children = _request_children.get(key)
+    if children is None:
+        view = view or "unmatched"
+        children = _request_children[key] = (
+            REQUEST_LATENCY.labels(view, method, status),
+            REQUEST_DB_TIME.labels(view, method),
+            REQUEST_QUERIES.labels(view, method),
+        )
+    latency, db_time, queries = children
+    latency.observe(seconds)
+    db_time.observe(timings.db)
+    if timings.queries:
+        queries.inc(timings.queries)
+
+
+def count_cache(cache, hit):
+    if ENABLED:
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def count_auth(kind, outcome):
+    """kind: "token" or "login"; outcome e.g. "ok", "failed", "unknown_user", "busy" """
+    if ENABLED:
+        AUTH_ATTEMPTS.labels(kind, outcome).inc()
+
+
+def set_pool_sizes(alias, max_size, in_use, idle):
+    if ENABLED:
+        DB_POOL_MAX_SIZE.labels(alias).set(max_size)
+        DB_POOL_CONNECTIONS.labels(alias, "in_use").set(in_use)
+        DB_POOL_CONNECTIONS.labels(alias, "idle").set(idle)
+
+
+def count_pool(alias, event, amount=1):
+    """event: a ConnectionPool stats key, "created", "reused", "discarded", "health_checks" or "timeouts" """
+    if ENABLED:
+        DB_POOL_EVENTS.labels(alias, event).inc(amount)
+
+
+def observe_pool_wait(alias, seconds):
+    if ENABLED:
+        DB_POOL_WAIT.labels(alias).observe(seconds)
+
+
+def scrape():
+    """(body, content type) of every metric, summed over all worker processes in multiprocess mode"""
+    registry = REGISTRY
+    if MULTIPROCESS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, wants "Authorization: Bearer <METRICS["TOKEN"]>", the bearer_token of the scrape
+    config. Refuses every request when no token is set: view names, traffic and pool sizes are not public.
+    """
+    token = METRICS.get("TOKEN")
+    if not token or not constant_time_compare(request.META.get("HTTP_AUTHORIZATION", ""), f"Bearer {token}"):
+        return HttpResponseForbidden()
+    body, content_type = scrape()
+    return HttpResponse(body, content_type=content_type)
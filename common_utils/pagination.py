@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.db.models import Q
+
+PAGINATION = getattr(settings, "PAGINATION", {})
+DEFAULT_LIMIT = PAGINATION.get("DEFAULT_LIMIT", 50)
+MAX_LIMIT = PAGINATION.get("MAX_LIMIT", 200)
+
+_CURSOR_SALT = "common_utils.pagination.cursor"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_limit(request):
+    try:
+        limit = int(request.query_params.get("limit", DEFAULT_LIMIT))
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination on (field, id).
+    Each page is a range scan starting right after the row the cursor points at,
+    so page N costs the same as page 1 (no OFFSET).
+    Works on model querysets and on .values() querysets as long as `field` and `id` are selected.
+    """
+
+    def __init__(self, field="created_at", descending=False):
+        self.field = field
+        self.descending = descending
+
+    @property
+    def keys(self):
+        """columns a .values() / values_list() queryset needs for paging"""
+        return (self.field, "id")
+
+    def _ordering(self, descending):
+        prefix = "-" if descending else ""
+        return (prefix + self.field, prefix + "id")
+
+    def _value(self, row, name):
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    def _after(self, key, descending):
+        lookup = "lt" if descending else "gt"
+        value, pk = key
+        return Q(**{f"{self.field}__{lookup}": value}) | Q(**{self.field: value, f"id__{lookup}": pk})
+
+    def encode(self, direction, row):
+        value = self._value(row, self.field)
+        payload = {
+            "d": direction,
+            "o": self._ordering(self.descending)[0],
+            "v": value.isoformat() if hasattr(value, "isoformat") else str(value),
+            "id": str(self._value(row, "id")),
+        }
+        return signing.dumps(payload, salt=_CURSOR_SALT, compress=True)
+
+    def decode(self, cursor):
+        try:
+            payload = signing.loads(cursor, salt=_CURSOR_SALT)
+            direction, key = payload["d"], (payload["v"], payload["id"])
+        except (signing.BadSignature, KeyError, TypeError):
+            raise InvalidCursor("Invalid cursor.")
+        # a cursor from another sort order would compare the wrong column
+        order = self._ordering(self.descending)[0]
+        if payload.get("o", order) != order:
+            raise InvalidCursor("Cursor belongs to a different sort order.")
+        return direction, key
+
+    def paginate(self, request, queryset):
+        """
+        returns (rows, paging) where paging is {"next": cursor, "prev": cursor, "limit": limit}
+        """
+        limit = get_limit(request)
+        cursor = request.query_params.get("cursor")
+        direction, key = "next", None
+        if cursor:
+            direction, key = self.decode(cursor)
+        forward = direction != "prev"
+
+        descending = self.descending if forward else not self.descending
+        queryset = queryset.order_by(*self._ordering(descending))
+        if key is not None:
+            queryset = queryset.filter(self._after(key, descending))
+
+        rows = list(queryset[: limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = prev_cursor = None
+        if rows:
+            if forward:
+                next_cursor = self.encode("next", rows[-1]) if has_more else None
+                prev_cursor = self.encode("prev", rows[0]) if key is not None else None
+            else:
+                next_cursor = self.encode("next", rows[-1])
+                prev_cursor = self.encode("prev", rows[0]) if has_more else None
+        return rows, {"next": next_cursor, "prev": prev_cursor, "limit": limit}
+
+    def stream(self, queryset, chunk_size):
+        """
+        Iterates every row of queryset in (field, id) order, for streamed responses.
+        Reads through a server-side cursor, or when those are disabled (pgbouncer in transaction mode)
+        one keyset range query per chunk, since a client side cursor would load the whole result at once.
+        """
+        queryset = queryset.order_by(*self._ordering(self.descending))
+        if not connections[queryset.db].settings_dict.get("DISABLE_SERVER_SIDE_CURSORS"):
+            yield from queryset.iterator(chunk_size=chunk_size)
+            return
+        key = None
+        while True:
+            page = queryset if key is None else queryset.filter(self._after(key, self.descending))
+            rows = list(page[:chunk_size])
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            key = (self._value(rows[-1], self.field), self._value(rows[-1], "id"))
@@ -0,0 +1,203 @@
+"""
+PostgreSQL backend that hands out connections from a bounded per-process pool.
+
+Use it as ENGINE "common_utils.pooled_postgresql" with pool options in DATABASES[alias]["POOL"]:
+    MAX_SIZE                connections per process, checkouts beyond it wait for one to be returned
+    TIMEOUT                 seconds to wait for a free connection before failing
+    HEALTH_CHECK_INTERVAL   connections idle for longer are probed with SELECT 1 before reuse
+
+Closing a Django connection (end of request with CONN_MAX_AGE=0, or when it expires) returns it to the pool.
+Pool sizes, checkouts, discards and waits are exported by common_utils.metrics as db_pool_* metrics.
+"""
+import logging
+import os
+import threading
+import time
+
+import psycopg2
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from common_utils import metrics
+
+logger = logging.getLogger(__name__)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, max_size=20, timeout=10, health_check_interval=30, alias="default"):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.isolation_level = None
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []  # (connection, returned_at), most recently returned last
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._in_use = 0
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "health_checks": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+        }
+        metrics.set_pool_sizes(alias, max_size, 0, 0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+        metrics.count_pool(self.alias, name, amount)
+
+    def _publish_sizes(self):
+        # called with self._lock held
+        metrics.set_pool_sizes(self.alias, self.max_size, self._in_use, len(self._idle))
+
+    def _check_fork(self):
+        # connections opened before a fork (gunicorn --preload) belong to the parent
+        if self._pid != os.getpid():
+            with self._lock:
+                self._idle, self._pid = [], os.getpid()
+                self._publish_sizes()
+
+    def _healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        self._count("health_checks")
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error as e:
+            logger.info("Pooled connection failed its health check, discarding it: %s", e)
+            return False
+
+    def _discard(self, connection):
+        self._count("discarded")
+        try:
+            connection.close()
+        except psycopg2.Error:
+            # broken already, nothing left to close
+            pass
+
+    def acquire(self, connect):
+        """returns (connection, created), `connect` opens a new connection when no idle one is usable"""
+        self._check_fork()
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("timeouts")
+            raise OperationalError(f"Connection pool exhausted, no connection free after {self.timeout}s.")
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["wait_seconds"] += waited
+            self._in_use += 1
+            self._publish_sizes()
+        metrics.observe_pool_wait(self.alias, waited)
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                    self._publish_sizes()
+                if item is None:
+                    connection = connect()
+                    self._count("created")
+                    return connection, True
+                if self._healthy(*item):
+                    self._count("reused")
+                    return item[0], False
+                self._discard(item[0])
+        except BaseException:
+            self._give_back_slot()
+            raise
+
+    def _give_back_slot(self):
+        with self._lock:
+            self._in_use -= 1
+            self._publish_sizes()
+        self._slots.release()
+
+    def release(self, connection):
+        try:
+            if not connection.closed:
+                status = connection.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    self._discard(connection)
+                    return
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+            else:
+                self._count("discarded")
+        except psycopg2.Error as e:
+            # the connection broke while in use, the rollback or status check found out
+            logger.info("Pooled connection broken on release, discarding it: %s", e)
+            self._discard(connection)
+        finally:
+            self._give_back_slot()
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            return dict(self._stats, max_size=self.max_size, idle=idle, in_use=self._in_use, open=idle + self._in_use)
+
+
+def get_pool(alias, settings_dict):
+    with _pools_lock:
+        if alias not in _pools:
+            options = settings_dict.get("POOL", {})
+            _pools[alias] = ConnectionPool(
+                max_size=options.get("MAX_SIZE", 20),
+                timeout=options.get("TIMEOUT", 10),
+                health_check_interval=options.get("HEALTH_CHECK_INTERVAL", 30),
+                alias=alias,
+            )
+        return _pools[alias]
+
+
+def pool_stats():
+    """{alias: stats} for every pool opened in this process"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {alias: pool.stats() for alias, pool in pools.items()}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = get_pool(self.alias, self.settings_dict)
+        self._checked_at = time.monotonic()
+
+    def get_new_connection(self, conn_params):
+        connection, created = self.pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        if created:
+            self.pool.isolation_level = self.isolation_level
+        else:
+            self.isolation_level = self.pool.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            self.pool.release(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        """
+        Also health checks persistent connections (CONN_MAX_AGE > 0) that sat idle between requests
+        for longer than HEALTH_CHECK_INTERVAL, so a request never starts on a dead connection.
+        """
+        super().close_if_unusable_or_obsolete()
+        now = time.monotonic()
+        if (
+            self.connection is not None
+            and not self.in_atomic_block
+            and now - self._checked_at >= self.pool.health_check_interval
+            and not self.is_usable()
+        ):
+            self.close()
+        self._checked_at = now
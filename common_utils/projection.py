@@ -0,0 +1,78 @@
+class InvalidFields(Exception):
+    pass
+
+
+class Column:
+    """an output field read from `path`, passed through `convert` when the output type differs from the column's"""
+
+    def __init__(self, path, convert=None):
+        self.path = path
+        self.convert = convert
+
+
+class Projection:
+    """
+    Declarative output schema for read endpoints, output name -> ORM path (str) or Column.
+    Paths may follow foreign keys ("owner__name") and JSON keys ("image_urls__thumb"); the joins come from the
+    paths, so nothing else needs select_related. query() reads exactly those columns through values_list(),
+    rows() turns the tuples into output dicts. No model instances are built.
+    """
+
+    def __init__(self, **fields):
+        self.fields = {name: field if isinstance(field, Column) else Column(field) for name, field in fields.items()}
+        self.names = tuple(self.fields)
+        self.paths = tuple(field.path for field in self.fields.values())
+        self._converters = [(i, field.convert) for i, field in enumerate(self.fields.values()) if field.convert]
+
+    @classmethod
+    def of(cls, *paths):
+        """output names are the paths themselves"""
+        return cls(**{path: path for path in paths})
+
+    def select(self, names):
+        """projection of only `names`, in schema order; unknown names raise InvalidFields"""
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise InvalidFields(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(self.names)}.")
+        return Projection(**{name: field for name, field in self.fields.items() if name in names})
+
+    def for_request(self, request):
+        """
+        the projection narrowed to ?fields=a,b,c, or the whole projection without it.
+        Only the columns, and so the joins, of the requested fields are queried.
+        """
+        names = [name.strip() for name in request.query_params.get("fields", "").split(",") if name.strip()]
+        return self.select(names) if names else self
+
+    def query(self, queryset, *keys):
+        """
+        values_list() of the projection plus `keys`, extra columns the caller reads (e.g. a paging key) that
+        are not output. Rows are named tuples, attributes named after the paths.
+        """
+        extra = [key for key in keys if key not in self.paths]
+        return queryset.values_list(*self.paths, *extra, named=True)
+
+    def row(self, row):
+        if not self._converters:
+            return dict(zip(self.names, row))
+        values = list(row[: len(self.names)])
+        for i, convert in self._converters:
+            if values[i] is not None:
+                values[i] = convert(values[i])
+        return dict(zip(self.names, values))
+
+    def rows(self, rows):
+        return list(self.iter_rows(rows))
+
+    def iter_rows(self, rows):
+        if self._converters:
+            return map(self.row, rows)
+        names = self.names
+        return (dict(zip(names, row)) for row in rows)
+
+    def get(self, queryset):
+        """the single row of queryset as a dict, raises queryset.model.DoesNotExist"""
+        row = self.query(queryset).first()
+        if row is None:
+            raise queryset.model.DoesNotExist
+        return self.row(row)
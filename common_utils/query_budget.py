@@ -0,0 +1,161 @@
+"""
+Per view query budgets and N+1 detection.
+
+A view declares its budget as a class attribute, the most queries one request may run, per method:
+
+    class ListPlantsApiView(APIView):
+        query_budget = {"get": 3}
+
+QueryRecorder records every statement a block of code runs on this thread with the stack that issued it,
+check() compares a recording against a budget and flags statements repeated N_PLUS_ONE_THRESHOLD or more times
+with only their literals changed. The check_query_budgets command runs every route against it, and
+QueryBudgetMiddleware does the same for every request while QUERY_BUDGETS["ENABLED"] is set.
+"""
+import logging
+import re
+import traceback
+
+from django.conf import settings
+from django.db import connections
+
+QUERY_BUDGETS = getattr(settings, "QUERY_BUDGETS", {})
+N_PLUS_ONE_THRESHOLD = QUERY_BUDGETS.get("N_PLUS_ONE_THRESHOLD", 3)
+STACK_DEPTH = QUERY_BUDGETS.get("STACK_DEPTH", 6)
+
+logger = logging.getLogger(__name__)
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\bIN \((?:\?|%s)(?:, (?:\?|%s))*\)", re.IGNORECASE), "IN (...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize(sql):
+    """the statement with its literals replaced, so queries that differ only by parameters compare equal"""
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def _own_frames():
+    # the project frames only, Django and DRF internals say nothing about where a query came from
+    root = str(settings.BASE_DIR)
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(root) and "site-packages" not in frame.filename and frame.filename != __file__
+    ]
+    return tuple(f"{frame.filename[len(root) + 1:]}:{frame.lineno} in {frame.name}" for frame in frames[-STACK_DEPTH:])
+
+
+class QueryRecorder:
+    """
+    Context manager recording (sql, stack) for every statement run on this thread's connections.
+    Unlike CaptureQueriesContext it works with DEBUG off and keeps where each query came from.
+    """
+
+    def __init__(self, using=None):
+        self.aliases = [using] if using else list(connections)
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        # SQLite runs an explicit BEGIN that PostgreSQL connections send with their first statement
+        if sql != "BEGIN":
+            self.queries.append((sql, _own_frames()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrappers = [connections[alias].execute_wrapper(self) for alias in self.aliases]
+        for wrapper in self._wrappers:
+            wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        for wrapper in reversed(self._wrappers):
+            wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def groups(self):
+        """{normalized sql: [(sql, stack), ...]} in the order the statements first ran"""
+        groups = {}
+        for sql, stack in self.queries:
+            groups.setdefault(normalize(sql), []).append((sql, stack))
+        return groups
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """groups() of the statements run `threshold` or more times"""
+        return {key: runs for key, runs in self.groups().items() if len(runs) >= threshold}
+
+
+def budget_for(view_class, method):
+    """the declared budget of `view_class` for `method`, None when it has none"""
+    budget = getattr(view_class, "query_budget", None)
+    if isinstance(budget, dict):
+        return budget.get(method.lower())
+    return budget
+
+
+def _format_stacks(runs):
+    stacks = {}
+    for _, stack in runs:
+        stacks[stack] = stacks.get(stack, 0) + 1
+    lines = []
+    for stack, count in stacks.items():
+        lines.append(f"    {count}x from:")
+        lines.extend(f"      {frame}" for frame in stack or ("<outside the project>",))
+    return lines
+
+
+def check(label, budget, recorder, threshold=N_PLUS_ONE_THRESHOLD):
+    """
+    returns a list of problems with `recorder` against `budget`, each line by line with the queries grouped by
+    the stack that ran them; empty when the request is within budget and has no repeated statements
+    """
+    problems = []
+    if budget is None:
+        problems.append([f"{label}: no query_budget declared, ran {len(recorder)} queries"])
+    elif len(recorder) > budget:
+        lines = [f"{label}: {len(recorder)} queries, budget is {budget}"]
+        for key, runs in recorder.groups().items():
+            lines.append(f"  {len(runs)}x {key[:200]}")
+            lines.extend(_format_stacks(runs))
+        problems.append(lines)
+    for key, runs in recorder.repeated(threshold).items():
+        lines = [f"{label}: possible N+1, {len(runs)}x {key[:200]}"]
+        lines.extend(_format_stacks(runs))
+        problems.append(lines)
+    return problems
+
+
+class QueryBudgetMiddleware:
+    """
+    Checks every request against its view's query_budget, for local development and CI; settings only adds it
+    to MIDDLEWARE while QUERY_BUDGETS["ENABLED"] is set. Problems are logged, or raised as QueryBudgetExceeded
+    with QUERY_BUDGETS["RAISE"].
+    Views served through common_utils.async_views run on another thread and are not recorded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        view_class = getattr(getattr(match, "func", None), "view_class", None)
+        if view_class is not None:
+            problems = check(f"{request.method} {request.path}", budget_for(view_class, request.method), recorder)
+            if problems:
+                message = "\n".join("\n".join(lines) for lines in problems)
+                if QUERY_BUDGETS.get("RAISE"):
+                    raise QueryBudgetExceeded(message)
+                logger.warning(message)
+        return response
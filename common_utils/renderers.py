@@ -0,0 +1,41 @@
+import json
+
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from common_utils.timing import timed
+
+# UUID, datetime, date and time are native to orjson; Decimal, lazy strings etc. go through DRF's encoder
+_default = JSONEncoder().default
+_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data):
+    """
+    `data` as the bytes JSONRenderer renders it (compact, unicode, \\u2028 / \\u2029 escaped), encoded by orjson.
+    Anything orjson refuses (ints over 64 bits, lone surrogates) is encoded by the json module instead.
+    """
+    try:
+        ret = orjson.dumps(data, default=_default, option=_OPTIONS)
+    except orjson.JSONEncodeError:
+        ret = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+    if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+        ret = ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+    return ret
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Drop-in JSONRenderer with the same output, encoded by orjson.
+    Indented output (?format=json with indent, the browsable API) is left to JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        with timed("render"):
+            indent = self.get_indent(accepted_media_type, renderer_context or {})
+            if indent is not None or not self.compact or self.ensure_ascii:
+                return super().render(data, accepted_media_type, renderer_context)
+            return dumps(data)
@@ -1,5 +1,45 @@
+from django.http import StreamingHttpResponse
 from rest_framework.response import Response
 
+from common_utils.renderers import dumps
 
-def response(status_code, status, msg, data=[]):
-    return Response({"status": status, "message": msg, "data": data}, status_code)
+STREAM_CHUNK_SIZE = 500
+
+
+def response(status_code, status, msg, data=[], **extra):
+    return Response({"status": status, "message": msg, "data": data, **extra}, status_code)
+
+
+def wants_stream(request):
+    return request.query_params.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def _stream_envelope(status, msg, rows, chunk_size, extra):
+    # same encoding as FastJSONRenderer so output matches response()
+    head = dumps({"status": status, "message": msg})
+    yield head[:-1] + b',"data":['
+    chunk, sep = [], b""
+    for row in rows:
+        chunk.append(dumps(row))
+        if len(chunk) >= chunk_size:
+            yield sep + b",".join(chunk)
+            chunk, sep = [], b","
+    if chunk:
+        yield sep + b",".join(chunk)
+    tail = b"]"
+    if extra:
+        tail += b"," + dumps(extra)[1:-1]
+    yield tail + b"}"
+
+
+def stream_response(status_code, status, msg, rows, chunk_size=STREAM_CHUNK_SIZE, **extra):
+    """
+    Same {"status", "message", "data"} envelope as response(), but `data` is encoded
+    chunk by chunk while `rows` is consumed, so the full list is never held in memory.
+    Pass KeysetPaginator.stream() or a queryset .iterator() as rows to read the rows in chunks.
+    """
+    return StreamingHttpResponse(
+        _stream_envelope(status, msg, rows, chunk_size, extra),
+        status=status_code,
+        content_type="application/json",
+    )
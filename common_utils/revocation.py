@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection
+
+from common_utils.shared_cache import saves_queries, shared_cache
+from user_management.models import Buyer, Nursery
+
+logger = logging.getLogger(__name__)
+_SHARED_PREFIX = "auth:revoked:"
+
+
+class BloomFilter:
+    """Fixed size bloom filter over strings, sized for `capacity` items at `error_rate` false positives."""
+
+    def __init__(self, capacity=10000, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.sha256(item.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationSet:
+    """
+    In-process set of revoked (soft deleted) user ids.
+    Lookups hit the bloom filter first and only consult the exact set on a possible match.
+    The set is reloaded from the database every `refresh_interval` seconds on a background thread,
+    so only the very first lookup in a process waits on the database. A process rejects the ids it revoked itself
+    at once. Ids revoked by other processes are rejected after their next reload, up to `refresh_interval` seconds
+    later, or at once when the shared cache is one a lookup doesn't cost a query in (saves_queries()): a database
+    cache table would put a query back on every request.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._bloom = BloomFilter()
+        self._revoked = frozenset()
+        self._local = set()  # revoked by this process, kept across reloads that raced with the update
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @staticmethod
+    def _key(user_id):
+        return str(uuid.UUID(str(user_id)))
+
+    def load(self):
+        revoked = {
+            str(pk)
+            for model in (Buyer, Nursery)
+            for pk in model.objects.filter(isdeleted=True).values_list("id", flat=True).iterator()
+        }
+        with self._lock:
+            revoked |= self._local
+        bloom = BloomFilter(capacity=max(len(revoked) * 2, 10000))
+        for key in revoked:
+            bloom.add(key)
+        with self._lock:
+            self._bloom, self._revoked = bloom, frozenset(revoked)
+            self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        try:
+            self.load()
+        except Exception:
+            # keep the current set and retry after another interval, not on every request
+            logger.exception("Reloading revoked users failed, retrying in %ss.", self.refresh_interval)
+            with self._lock:
+                self._loaded_at = time.monotonic()
+        finally:
+            connection.close()
+            with self._lock:
+                self._refreshing = False
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None:
+            self.load()
+            return
+        if time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def revoke(self, user_id):
+        """
+        Call once the user is marked deleted, before answering. With a shared cache that saves queries the id goes
+        there first, so the other processes reject the user's tokens right away instead of after their next reload.
+        """
+        key = self._key(user_id)
+        if saves_queries():
+            # every process has reloaded it from the database long before the entry expires
+            shared_cache().set(_SHARED_PREFIX + key, True, timeout=self.refresh_interval * 10)
+        with self._lock:
+            self._local.add(key)
+            self._bloom.add(key)
+            self._revoked = self._revoked | {key}
+
+    def is_revoked(self, user_id):
+        self._ensure_fresh()
+        key = self._key(user_id)
+        bloom, revoked = self._bloom, self._revoked
+        if key in bloom and key in revoked:
+            return True
+        return saves_queries() and shared_cache().get(_SHARED_PREFIX + key) is not None
+
+
+revocations = RevocationSet(refresh_interval=settings.JWT_AUTH.get("REVOCATION_REFRESH_INTERVAL", 60))
@@ -0,0 +1,32 @@
+"""
+The "shared" cache alias: one store seen by every worker process, for state that a write in one process has to
+make visible to all of them at once (token revocations, the catalog version, unknown login emails).
+
+settings.CACHES["shared"] defaults to the database cache table, created with `python3 manage.py createcachetable`;
+memcached does the same with less latency. Local memory or dummy backends are per process, is_shared() tells
+callers so they can turn off what would go stale in the other workers.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+ALIAS = "shared"
+PER_PROCESS_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+DATABASE_BACKEND = "django.core.cache.backends.db.DatabaseCache"
+
+
+def shared_cache():
+    return caches[ALIAS]
+
+
+def is_shared():
+    """False when the "shared" alias is missing or keeps its entries inside each process"""
+    backend = settings.CACHES.get(ALIAS, {}).get("BACKEND")
+    return backend is not None and backend not in PER_PROCESS_BACKENDS
+
+
+def saves_queries():
+    """True when "shared" is shared and not the database table, where a cache read costs a query like any other"""
+    return is_shared() and settings.CACHES[ALIAS]["BACKEND"] != DATABASE_BACKEND
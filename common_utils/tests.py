@@ -0,0 +1,201 @@
+import threading
+from unittest import mock
+
+import psycopg2
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from prometheus_client import REGISTRY
+from psycopg2 import extensions
+
+from common_utils import metrics, timing
+from common_utils.pooled_postgresql.base import ConnectionPool
+from common_utils.query_budget import QueryRecorder, check, normalize
+
+
+class FakeConnection:
+    """the parts of a psycopg2 connection the pool uses"""
+
+    def __init__(self, status=extensions.TRANSACTION_STATUS_IDLE):
+        self.closed = 0
+        self.status = status
+        self.rolled_back = False
+        self.broken = False
+
+    def get_transaction_status(self):
+        if self.broken:
+            raise psycopg2.InterfaceError("connection already closed")
+        return self.status
+
+    def rollback(self):
+        self.rolled_back = True
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+    def cursor(self):
+        if self.broken:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return mock.MagicMock()
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        patch = mock.patch.object(metrics, "ENABLED", True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.alias = f"test-{self._testMethodName}"
+        self.pool = ConnectionPool(max_size=2, timeout=0.05, health_check_interval=30, alias=self.alias)
+        self.opened = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def metric(self, name, **labels):
+        return REGISTRY.get_sample_value(name, dict(labels, alias=self.alias))
+
+    def test_returned_connections_are_reused(self):
+        first, created = self.pool.acquire(self.connect)
+        self.assertTrue(created)
+        self.assertEqual(self.metric("db_pool_connections", state="in_use"), 1)
+        self.pool.release(first)
+        again, created = self.pool.acquire(self.connect)
+        self.assertIs(again, first)
+        self.assertFalse(created)
+        self.pool.release(again)
+        stats = self.pool.stats()
+        self.assertEqual((stats["created"], stats["reused"], stats["in_use"], stats["idle"]), (1, 1, 0, 1))
+        self.assertEqual(self.metric("db_pool_events_total", event="reused"), 1)
+        self.assertEqual(self.metric("db_pool_connections", state="idle"), 1)
+        self.assertEqual(self.metric("db_pool_max_size"), 2)
+
+    def test_open_transaction_rolled_back_on_release(self):
+        connection, _ = self.pool.acquire(self.connect)
+        connection.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.release(connection)
+        self.assertTrue(connection.rolled_back)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+
+    def test_exhausted_pool_times_out(self):
+        held = [self.pool.acquire(self.connect)[0] for _ in range(2)]
+        with self.assertRaises(OperationalError):
+            self.pool.acquire(self.connect)
+        self.assertEqual(self.pool.stats()["timeouts"], 1)
+        self.assertEqual(self.metric("db_pool_events_total", event="timeouts"), 1)
+
+        # a release frees a slot for a waiting checkout
+        waiter = threading.Timer(0.01, self.pool.release, (held.pop(),))
+        waiter.start()
+        self.pool.timeout = 1
+        connection, created = self.pool.acquire(self.connect)
+        waiter.join()
+        self.assertFalse(created)
+        self.assertEqual(self.pool.stats()["in_use"], 2)
+
+    def test_connection_broken_in_use_is_discarded(self):
+        connection, _ = self.pool.acquire(self.connect)
+        connection.broken = True
+        with self.assertLogs("common_utils.pooled_postgresql.base", "INFO"):
+            self.pool.release(connection)
+        stats = self.pool.stats()
+        self.assertEqual((stats["discarded"], stats["idle"], stats["in_use"]), (1, 0, 0))
+        self.assertTrue(connection.closed)
+        # its slot came back
+        self.assertEqual(len([self.pool.acquire(self.connect) for _ in range(2)]), 2)
+
+    def test_unknown_transaction_status_is_discarded(self):
+        connection, _ = self.pool.acquire(self.connect)
+        connection.status = extensions.TRANSACTION_STATUS_UNKNOWN
+        self.pool.release(connection)
+        self.assertEqual((self.pool.stats()["discarded"], self.pool.stats()["idle"]), (1, 0))
+
+    def test_idle_connection_failing_health_check_is_replaced(self):
+        stale, _ = self.pool.acquire(self.connect)
+        self.pool.release(stale)
+        stale.broken = True
+        self.pool.health_check_interval = 0
+        with self.assertLogs("common_utils.pooled_postgresql.base", "INFO"):
+            connection, created = self.pool.acquire(self.connect)
+        self.assertTrue(created)
+        self.assertIsNot(connection, stale)
+        stats = self.pool.stats()
+        self.assertEqual((stats["health_checks"], stats["discarded"], stats["in_use"]), (1, 1, 1))
+
+    def test_failed_connect_gives_the_slot_back(self):
+        def refuse():
+            raise psycopg2.OperationalError("could not connect to server")
+
+        for _ in range(3):
+            with self.assertRaises(psycopg2.OperationalError):
+                self.pool.acquire(refuse)
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+
+
+class MetricsViewTests(SimpleTestCase):
+    def scrape(self, token, **headers):
+        with mock.patch.dict(metrics.METRICS, TOKEN=token):
+            return metrics.metrics_view(RequestFactory().get("/api/metrics/", **headers))
+
+    def test_needs_the_token(self):
+        self.assertEqual(self.scrape("secret").status_code, 403)
+        self.assertEqual(self.scrape("secret", HTTP_AUTHORIZATION="Bearer other").status_code, 403)
+        self.assertEqual(self.scrape("secret", HTTP_AUTHORIZATION="Bearer secret").status_code, 200)
+
+    def test_refused_without_a_token_set(self):
+        self.assertEqual(self.scrape(None).status_code, 403)
+        self.assertEqual(self.scrape("", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+
+class ServerTimingTests(SimpleTestCase):
+    def test_header_is_a_regular_response_header(self):
+        middleware = timing.ServerTimingMiddleware(lambda request: HttpResponse("ok"))
+        response = middleware(RequestFactory().get("/"))
+        self.assertTrue(response.has_header("server-timing"))
+        self.assertRegex(response["Server-Timing"], r'^auth;dur=[\d.]+, db;dur=[\d.]+;desc="0 queries", render;')
+        self.assertIn(("Server-Timing", response["Server-Timing"]), list(response.items()))
+
+
+class QueryBudgetTests(SimpleTestCase):
+    def record(self, *statements):
+        recorder = QueryRecorder()
+        for sql in statements:
+            recorder(lambda *args: None, sql, (), False, {})
+        return recorder
+
+    def test_normalize_replaces_literals(self):
+        self.assertEqual(
+            normalize("SELECT  *\n FROM plants WHERE name = 'O''Brien' AND price > 12.50 AND id IN (%s, %s, %s)"),
+            "SELECT * FROM plants WHERE name = ? AND price > ? AND id IN (...)",
+        )
+        self.assertEqual(normalize("SELECT * FROM t WHERE id IN (1, 2)"), normalize("SELECT * FROM t WHERE id IN (3)"))
+        # identifiers with digits stay apart
+        self.assertNotEqual(normalize('SELECT "col1" FROM t'), normalize('SELECT "col2" FROM t'))
+
+    def test_repeated_groups_statements_differing_by_literals(self):
+        recorder = self.record(
+            "SELECT * FROM plants WHERE id = 1",
+            "SELECT * FROM cart WHERE user_id = 7",
+            "SELECT * FROM plants WHERE id = 2",
+            "SELECT * FROM plants WHERE id = 3",
+        )
+        self.assertEqual(list(recorder.repeated(3)), ["SELECT * FROM plants WHERE id = ?"])
+        self.assertEqual(len(recorder.repeated(3)["SELECT * FROM plants WHERE id = ?"]), 3)
+        self.assertEqual(recorder.repeated(4), {})
+
+    def test_begin_is_not_counted(self):
+        self.assertEqual(len(self.record("BEGIN", "SELECT 1")), 1)
+
+    def test_check(self):
+        recorder = self.record("SELECT 1", "SELECT 2", "SELECT 3")
+        self.assertEqual(check("view GET", 3, recorder, threshold=4), [])
+        problems = check("view GET", 2, recorder, threshold=3)
+        self.assertEqual(
+            [lines[0] for lines in problems],
+            ["view GET: 3 queries, budget is 2", "view GET: possible N+1, 3x SELECT ?"],
+        )
+        self.assertEqual(
+            check("view GET", None, recorder, threshold=4)[0][0], "view GET: no query_budget declared, ran 3 queries"
+        )
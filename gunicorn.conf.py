@@ -0,0 +1,9 @@
+import os
+
+
+def child_exit(server, worker):
+    # drop the metrics files of a worker that is gone, see common_utils.metrics
+    if os.environ.get("METRICS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid, os.environ["METRICS_MULTIPROC_DIR"])
@@ -9,8 +9,10 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "nurserymarket.settings")
+os.environ.setdefault("ASYNC_VIEWS", "True")
+
+# reads the settings when imported
+from common_utils.async_views import get_asgi_application  # noqa: E402
 
 application = get_asgi_application()
@@ -26,9 +26,12 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.environ.get("SECRET_KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Local development only: set DEBUG=True, which also turns on the debug toolbar and the browsable API
+DEBUG = os.environ.get("DEBUG", "False") == "True"
 
 ALLOWED_HOSTS = ["dphi-nursery-sde.herokuapp.com"]
+if DEBUG:
+    ALLOWED_HOSTS += ["localhost", "127.0.0.1"]
 
 
 # Application definition
@@ -40,6 +43,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "user_management",
     "plants",
@@ -56,7 +60,8 @@ AUTH_USER_MODEL = "user_management.User"
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    # whitenoise's middleware with async support, see common_utils.async_views
+    "common_utils.async_views.AsyncWhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -64,9 +69,13 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+if DEBUG:
+    MIDDLEWARE += [
+        "debug_toolbar.middleware.DebugToolbarMiddleware",
+    ]
+
 ROOT_URLCONF = "nurserymarket.urls"
 
 TEMPLATES = [
@@ -91,18 +100,60 @@ WSGI_APPLICATION = "nurserymarket.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# common_utils.pooled_postgresql keeps a bounded pool of connections per process (see its docstring).
+# With the pool, CONN_MAX_AGE=0 returns connections to it after every request; above 0 each thread keeps its own.
+# Behind pgbouncer in transaction mode set DB_PGBOUNCER_TRANSACTION_MODE=True: server-side cursors can't
+# outlive a transaction there, so they are disabled.
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": os.environ.get("DB_ENGINE", "common_utils.pooled_postgresql"),
         "NAME": os.environ.get("db_name"),
         "USER": os.environ.get("db_user"),
         "PASSWORD": os.environ.get("db_user_password"),
         "HOST": os.environ.get("host"),
         "PORT": os.environ.get("port"),
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 0)),
+        "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("DB_PGBOUNCER_TRANSACTION_MODE", "False") == "True",
+        "POOL": {
+            "MAX_SIZE": int(os.environ.get("DB_POOL_MAX_SIZE", 20)),
+            "TIMEOUT": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
+            "HEALTH_CHECK_INTERVAL": int(os.environ.get("DB_HEALTH_CHECK_INTERVAL", 30)),
+        },
     }
 }
 
 
+# Cache
+# "shared" is seen by every worker process (common_utils.shared_cache), state written by one request has to reach
+# all of them: token revocations and the catalog version. The database table (`python3 manage.py createcachetable`)
+# works anywhere but costs a query per read and three per write, memcached is faster:
+# SHARED_CACHE_BACKEND=django.core.cache.backends.memcached.PyLibMCCache and SHARED_CACHE_LOCATION=<host:port>.
+# "catalog" holds list_plants pages (plants.catalog_cache), keyed by the version in "shared", so a per process
+# backend is fine for it. Pages are not cached at all while "shared" is a per process backend.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": os.environ.get("SHARED_CACHE_BACKEND", "django.core.cache.backends.db.DatabaseCache"),
+        "LOCATION": os.environ.get("SHARED_CACHE_LOCATION", "shared_cache"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", 100000))},
+    },
+    "catalog": {
+        "BACKEND": os.environ.get("CATALOG_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("CATALOG_CACHE_LOCATION", "catalog"),
+    },
+}
+
+# Each process trusts the catalog version it read for VERSION_TTL seconds, so a cached page or a 304 runs no query
+# even with the database table as "shared"; a change reaches the other workers' pages within that time.
+CATALOG_CACHE = {
+    "ALIAS": "catalog",
+    "TIMEOUT": int(os.environ.get("CATALOG_CACHE_TIMEOUT", 300)),
+    "VERSION_TTL": float(os.environ.get("CATALOG_VERSION_TTL", 5)),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -154,6 +205,30 @@ MEDIA_URL = "/media/"
 JWT_AUTH = {
     "JWT_EXPIRATION_DELTA": datetime.utcnow() + timedelta(days=30),
     "JWT_AUTH_HEADER_PREFIX": "Bearer",
+    # Stateless tokens carry the permission claims, requests authenticate without a user lookup.
+    # Deleted users are rejected through common_utils.revocation, reloaded every REVOCATION_REFRESH_INTERVAL seconds.
+    # The worker that deleted the user rejects it at once, the others after their next reload. With memcached as the
+    # "shared" cache they check it for users deleted since, at no query per request; the database table is not read.
+    "STATELESS": os.environ.get("JWT_STATELESS", "False") == "True",
+    "REVOCATION_REFRESH_INTERVAL": int(os.environ.get("JWT_REVOCATION_REFRESH_INTERVAL", 60)),
+}
+
+# Verified principal cache used by common_utils.custom_auth.TokenAuthentication, one per process. A profile change
+# reaches the other workers' caches within TTL seconds, or at once with memcached as the "shared" cache; deleted
+# users are rejected within JWT_AUTH["REVOCATION_REFRESH_INTERVAL"].
+AUTH_PRINCIPAL_CACHE = {
+    "TTL": int(os.environ.get("AUTH_PRINCIPAL_CACHE_TTL", 60)),
+    "MAX_SIZE": int(os.environ.get("AUTH_PRINCIPAL_CACHE_MAX_SIZE", 10000)),
+}
+
+# Login and registration hashing (common_utils.hashing): WORKERS threads hash at a time, MAX_QUEUE more wait,
+# the rest get a 503 right away. Unknown login emails are remembered for UNKNOWN_EMAIL_TTL seconds in the "shared"
+# cache, only when it is memcached or the like: in the database table a lookup costs as much as the login query.
+PASSWORD_HASHING = {
+    "WORKERS": int(os.environ.get("PASSWORD_HASH_WORKERS", 2)),
+    "MAX_QUEUE": int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", 16)),
+    "TIMEOUT": int(os.environ.get("PASSWORD_HASH_TIMEOUT", 10)),
+    "UNKNOWN_EMAIL_TTL": int(os.environ.get("AUTH_UNKNOWN_EMAIL_TTL", 300)),
 }
 
 # Django Debug Toolbar
@@ -163,14 +238,83 @@ INTERNAL_IPS = [
 ]
 
 # Rest Framework
+# FastJSONRenderer renders the same bytes as rest_framework.renderers.JSONRenderer, through orjson
 REST_FRAMEWORK = {
-    "DEFAULT_RENDERER_CLASSES": (
-        "rest_framework.renderers.JSONRenderer",
-        "rest_framework.renderers.BrowsableAPIRenderer",
-    ),
+    "DEFAULT_RENDERER_CLASSES": ("common_utils.renderers.FastJSONRenderer",),
     "DEFAULT_SCHEMA_CLASS": "rest_framework.schemas.coreapi.AutoSchema",
 }
 
+if DEBUG:
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] += ("rest_framework.renderers.BrowsableAPIRenderer",)
+
+# Async serving of the read heavy views under ASGI (common_utils.async_views), nurserymarket.asgi turns it on
+ASYNC_VIEWS = {
+    "ENABLED": os.environ.get("ASYNC_VIEWS", "False") == "True",
+    "THREADS": int(os.environ.get("ASYNC_VIEW_THREADS", 16)),
+}
+
+# Bulk plant upload (plants.ingest)
+BULK_INGEST = {
+    "BATCH_SIZE": int(os.environ.get("BULK_INGEST_BATCH_SIZE", 1000)),
+    "MAX_ERRORS": int(os.environ.get("BULK_INGEST_MAX_ERRORS", 1000)),
+}
+
+# Server-Timing header and one JSON log line per request with auth / db / render / total time (common_utils.timing).
+# The lines are logged at INFO, see LOGGING; LOG_SAMPLE_RATE logs that fraction of requests once they are on.
+SERVER_TIMING = {
+    "ENABLED": os.environ.get("SERVER_TIMING_ENABLED", "True") == "True",
+    "LOG_SAMPLE_RATE": float(os.environ.get("SERVER_TIMING_LOG_SAMPLE_RATE", 1)),
+}
+
+if SERVER_TIMING["ENABLED"]:
+    # first, so total covers the whole stack
+    MIDDLEWARE.insert(0, "common_utils.timing.ServerTimingMiddleware")
+
+# Prometheus metrics (common_utils.metrics), scraped from /api/metrics/ with METRICS_TOKEN as the bearer token.
+# On by default only when a token is set; without one the endpoint refuses every scrape. Under gunicorn point
+# METRICS_MULTIPROC_DIR at an empty directory shared by the workers, cleared on every deploy, so a scrape covers all
+# of them. Request metrics come from the Server-Timing middleware.
+METRICS = {
+    "ENABLED": os.environ.get("METRICS_ENABLED", str(bool(os.environ.get("METRICS_TOKEN")))) == "True",
+    "TOKEN": os.environ.get("METRICS_TOKEN"),
+    "MULTIPROCESS_DIR": os.environ.get("METRICS_MULTIPROC_DIR"),
+}
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        # INFO logs a line per request, about 30µs each on top of the middleware's 2.5µs; the header is sent either way
+        "common_utils.timing": {
+            "handlers": ["console"],
+            "level": os.environ.get("SERVER_TIMING_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
+# Query budgets (common_utils.query_budget): with QUERY_BUDGETS_ENABLED=True every request is checked against its
+# view's query_budget and for statements repeated N_PLUS_ONE_THRESHOLD times, problems are logged or with
+# QUERY_BUDGETS_RAISE=True raised. `manage.py check_query_budgets` runs the same check over every route.
+QUERY_BUDGETS = {
+    "ENABLED": os.environ.get("QUERY_BUDGETS_ENABLED", "False") == "True",
+    "RAISE": os.environ.get("QUERY_BUDGETS_RAISE", "False") == "True",
+    "N_PLUS_ONE_THRESHOLD": int(os.environ.get("QUERY_BUDGETS_N_PLUS_ONE_THRESHOLD", 3)),
+}
+
+# added only when enabled: Django 3.1 mis-adapts the handler chain under ASGI when a middleware raises MiddlewareNotUsed
+if QUERY_BUDGETS["ENABLED"]:
+    MIDDLEWARE += ["common_utils.query_budget.QueryBudgetMiddleware"]
+
+# Cursor pagination for list endpoints
+PAGINATION = {
+    "DEFAULT_LIMIT": int(os.environ.get("PAGINATION_DEFAULT_LIMIT", 50)),
+    "MAX_LIMIT": int(os.environ.get("PAGINATION_MAX_LIMIT", 200)),
+}
+
 # Cloudinary
 CLOUDINARY_STORAGE = {
     "CLOUD_NAME": os.environ.get("CLOUD_NAME"),
@@ -180,6 +324,25 @@ CLOUDINARY_STORAGE = {
 
 DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
 
+# Plant image processing (plants.images). Uploads are written to STAGING_DIR and resized in the background
+# into SIZES (longest edge in px), then saved to STORAGE. Set IMAGE_STORAGE=django.core.files.storage.FileSystemStorage
+# to keep images under MEDIA_ROOT, e.g. for tests or deployments without network access.
+# With IN_PROCESS off, run `python3 manage.py process_plant_images --watch` as a worker instead. A worker on another
+# machine (a separate dyno) cannot read STAGING_DIR: set STAGING_STORAGE to a storage both can reach.
+# Failed reads and saves are retried RETRIES times, waiting RETRY_BACKOFF seconds and doubling.
+IMAGE_PIPELINE = {
+    "STORAGE": os.environ.get("IMAGE_STORAGE", DEFAULT_FILE_STORAGE),
+    "STAGING_DIR": os.environ.get("IMAGE_STAGING_DIR", str(BASE_DIR / "image_staging")),
+    "STAGING_STORAGE": os.environ.get("IMAGE_STAGING_STORAGE"),
+    "SIZES": {"thumb": 160, "medium": 480, "large": 1280},
+    "FORMAT": "JPEG",
+    "QUALITY": int(os.environ.get("IMAGE_QUALITY", 82)),
+    "WORKERS": int(os.environ.get("IMAGE_WORKERS", 2)),
+    "IN_PROCESS": os.environ.get("IMAGE_IN_PROCESS", "True") == "True",
+    "RETRIES": int(os.environ.get("IMAGE_RETRIES", 3)),
+    "RETRY_BACKOFF": float(os.environ.get("IMAGE_RETRY_BACKOFF", 1)),
+}
+
 # Deploy
 # CSRF_COOKIE_SECURE = True
 # SESSION_COOKIE_SECURE = True
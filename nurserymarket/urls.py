@@ -13,12 +13,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-import debug_toolbar
 from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from rest_framework.documentation import include_docs_urls
 
+from common_utils.metrics import metrics_view
+
 urlpatterns = [
     path("api/admin/", admin.site.urls),
     path("api/auth/", include("user_management.urls")),
@@ -26,7 +27,14 @@ urlpatterns = [
     path("api/docs/", include_docs_urls(title="Nursery Market")),
 ]
 
+if settings.METRICS["ENABLED"]:
+    urlpatterns += [
+        path("api/metrics/", metrics_view),
+    ]
+
 if settings.DEBUG:
+    import debug_toolbar
+
     urlpatterns += [
         path("__debug__/", include(debug_toolbar.urls)),
     ]
\ No newline at end of file
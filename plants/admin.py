@@ -1,7 +1,8 @@
 from django.contrib import admin
-from .models import Plants, Cart, Order
+from .models import Plants, Cart, Order, DailyPlantSales
 
 # Register your models here.
 admin.site.register(Plants)
 admin.site.register(Cart)
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(Order)
+admin.site.register(DailyPlantSales)
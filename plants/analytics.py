@@ -0,0 +1,198 @@
+import logging
+from collections import defaultdict
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, Q, Subquery, Sum, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber, TruncDate
+
+from .models import DailyPlantSales, Order, Plants
+
+STATUS_COLUMNS = {
+    Order.PENDING: "pending_orders",
+    Order.CONFIRMED: "confirmed_orders",
+    Order.ON_THE_WAY: "on_the_way_orders",
+    Order.DELIVERED: "delivered_orders",
+    Order.CANCELLED: "cancelled_orders",
+}
+TOP_PLANTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def _bump(nursery_id, plant_id, day, deltas):
+    """
+    Adds `deltas` (column -> amount or SQL expression) to the rollup row, creating the row if needed.
+    A change to an order the rollup never counted (placed before the last rebuild) has no row to subtract from;
+    that nursery's day is rebuilt from Order instead.
+    """
+    deltas = {column: amount for column, amount in deltas.items() if not (isinstance(amount, int) and amount == 0)}
+    if not deltas:
+        return
+    row = DailyPlantSales.objects.filter(plant_id=plant_id, day=day)
+    if row.update(**{column: F(column) + amount for column, amount in deltas.items()}):
+        return
+    try:
+        with transaction.atomic():
+            DailyPlantSales.objects.create(nursery_id=nursery_id, plant_id=plant_id, day=day, **deltas)
+        return
+    except IntegrityError:
+        # created concurrently, add to it instead
+        if row.update(**{column: F(column) + amount for column, amount in deltas.items()}):
+            return
+    # no row and the deltas alone break the column checks, e.g. a negative count
+    logger.warning("No sales rollup row for plant %s on %s to apply %s to, rebuilding the day.", plant_id, day, deltas)
+    rebuild(nursery_id, day, day)
+
+
+def _bump_many(rows):
+    """
+    _bump for many rows with plain (not negative) amounts in one INSERT ... ON CONFLICT DO UPDATE, which adds to the
+    rows that exist. `rows`: {(nursery_id, plant_id, day): {column: amount}}
+    """
+    if not rows:
+        return
+    columns = ["orders", "quantity", "revenue", "paid_revenue"] + list(STATUS_COLUMNS.values())
+    fields = [DailyPlantSales._meta.get_field(name) for name in ["nursery", "plant", "day"] + columns]
+    values, params = [], []
+    # in (plant, day) order, concurrent checkouts lock the rows they share in the same order
+    for (nursery_id, plant_id, day), deltas in sorted(rows.items(), key=lambda item: (str(item[0][1]), item[0][2])):
+        row = [nursery_id, plant_id, day] + [deltas.get(column, 0) for column in columns]
+        params += [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+        values.append("(%s)" % ", ".join(["%s"] * len(fields)))
+    qn = connection.ops.quote_name
+    table = qn(DailyPlantSales._meta.db_table)
+    sql = "INSERT INTO {table} ({names}) VALUES {values} ON CONFLICT ({plant}, {day}) DO UPDATE SET {adds}".format(
+        table=table,
+        names=", ".join(qn(field.column) for field in fields),
+        values=", ".join(values),
+        plant=qn(fields[1].column),
+        day=qn(fields[2].column),
+        adds=", ".join(f"{qn(column)} = {table}.{qn(column)} + EXCLUDED.{qn(column)}" for column in columns),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def _placed_deltas(quantity, total, status, is_payed):
+    live = status != Order.CANCELLED
+    return {
+        "orders": 1,
+        "quantity": quantity if live else 0,
+        "revenue": total if live else 0,
+        "paid_revenue": total if is_payed else 0,
+        STATUS_COLUMNS[status]: 1,
+    }
+
+
+def record_order_placed(order):
+    """
+    For an order saved through Order.save, whose total and nursery were computed by the database:
+    both are read inside the rollup statement instead of being loaded first.
+    """
+    total = Subquery(Order.objects.filter(pk=order.pk).order_by().values("total")[:1])
+    nursery = Subquery(Plants.objects.filter(pk=order.plant_id).order_by().values("owner_id")[:1])
+    deltas = _placed_deltas(order.quantity, total, order.order_status, order.is_payed)
+    _bump(nursery, order.plant_id, order.ordered_at.date(), deltas)
+
+
+def record_orders_placed(orders):
+    """For orders with total and nursery_id already set, e.g. from bulk_create. One write for all of them."""
+    grouped = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        key = (order.nursery_id, order.plant_id, order.ordered_at.date())
+        for column, amount in _placed_deltas(order.quantity, order.total, order.order_status, order.is_payed).items():
+            grouped[key][column] += amount
+    _bump_many(grouped)
+
+
+def record_order_changed(order, old_status, old_is_payed):
+    """Moves an updated order between status columns and in or out of revenue / paid_revenue."""
+    deltas = defaultdict(int)
+    if old_status != order.order_status:
+        deltas[STATUS_COLUMNS[old_status]] -= 1
+        deltas[STATUS_COLUMNS[order.order_status]] += 1
+        if Order.CANCELLED in (old_status, order.order_status):
+            sign = -1 if order.order_status == Order.CANCELLED else 1
+            deltas["revenue"] += sign * order.total
+            deltas["quantity"] += sign * order.quantity
+    if old_is_payed != order.is_payed:
+        deltas["paid_revenue"] += order.total if order.is_payed else -order.total
+    _bump(order.nursery_id, order.plant_id, order.ordered_at.date(), deltas)
+
+
+def rebuild(nursery_id=None, date_from=None, date_to=None):
+    """Recomputes rollup rows from Order, optionally for one nursery and a date range. returns rows written"""
+    orders = Order.objects.annotate(day=TruncDate("ordered_at"))
+    rows = DailyPlantSales.objects.all()
+    if nursery_id:
+        orders = orders.filter(plant__owner_id=nursery_id)
+        rows = rows.filter(nursery_id=nursery_id)
+    if date_from:
+        orders = orders.filter(day__gte=date_from)
+        rows = rows.filter(day__gte=date_from)
+    if date_to:
+        orders = orders.filter(day__lte=date_to)
+        rows = rows.filter(day__lte=date_to)
+
+    live = ~Q(order_status=Order.CANCELLED)
+    status_counts = {
+        column: Count("id", filter=Q(order_status=status)) for status, column in STATUS_COLUMNS.items()
+    }
+    totals = (
+        orders.order_by()
+        .values("plant__owner_id", "plant_id", "day")
+        .annotate(
+            orders_count=Count("id"),
+            quantity_sum=Sum("quantity", filter=live),
+            revenue_sum=Sum("total", filter=live),
+            paid_revenue_sum=Sum("total", filter=Q(is_payed=True)),
+            **status_counts,
+        )
+    )
+    with transaction.atomic():
+        rows.delete()
+        created = DailyPlantSales.objects.bulk_create(
+            (
+                DailyPlantSales(
+                    nursery_id=row["plant__owner_id"],
+                    plant_id=row["plant_id"],
+                    day=row["day"],
+                    orders=row["orders_count"],
+                    quantity=row["quantity_sum"] or 0,
+                    revenue=row["revenue_sum"] or 0,
+                    paid_revenue=row["paid_revenue_sum"] or 0,
+                    **{column: row[column] for column in STATUS_COLUMNS.values()},
+                )
+                for row in totals.iterator()
+            ),
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def sales_summary(nursery_id, date_from, date_to):
+    """Per day totals and top plants by revenue for a nursery, read from the rollup only."""
+    rows = DailyPlantSales.objects.filter(nursery_id=nursery_id, day__gte=date_from, day__lte=date_to)
+    sums = {column: Sum(column) for column in ("orders", "quantity", "revenue", "paid_revenue")}
+    sums.update({column: Sum(column) for column in STATUS_COLUMNS.values()})
+    days = {row["day"]: dict(row, top_plants=[]) for row in rows.order_by("day").values("day").annotate(**sums)}
+    # the database ranks plants within each day, only the top TOP_PLANTS rows of a day come back
+    ranked = rows.order_by().annotate(
+        rank_in_day=Window(RowNumber(), partition_by=[F("day")], order_by=[F("revenue").desc(), F("plant_id").asc()])
+    )
+    sql, params = ranked.values("pk", "rank_in_day").query.sql_with_params()
+    top = rows.filter(pk__in=RawSQL(f"SELECT id FROM ({sql}) ranked WHERE rank_in_day <= %s", (*params, TOP_PLANTS)))
+    for row in top.order_by("day", "-revenue", "plant_id").values(
+        "day", "plant_id", "plant__name", "orders", "quantity", "revenue"
+    ):
+        days[row["day"]]["top_plants"].append(
+            {
+                "plant_id": row["plant_id"],
+                "plant_name": row["plant__name"],
+                "orders": row["orders"],
+                "quantity": row["quantity"],
+                "revenue": row["revenue"],
+            }
+        )
+    return list(days.values())
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PlantsConfig(AppConfig):
     name = 'plants'
+
+    def ready(self):
+        from . import signals  # noqa
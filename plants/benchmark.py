@@ -0,0 +1,458 @@
+"""
+Dataset seeding and a concurrent load driver for every route of plants.urls and user_management.urls,
+used by the seed_benchmark_data, run_benchmarks and check_query_budgets commands and the query budget tests.
+
+Requests go through the full middleware and view stack in process (django.test.Client), one client per
+worker thread, so query counts can be captured per request. Under ASYNC_VIEWS the views run on another
+thread and their queries are not counted.
+"""
+import json
+import random
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import close_old_connections, connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+
+from common_utils import shared_cache
+from common_utils.custom_auth import generate_token, principal_cache
+from common_utils.query_budget import N_PLUS_ONE_THRESHOLD, QueryRecorder, budget_for, check
+from user_management.models import Buyer, Nursery
+
+from . import analytics, catalog_cache
+from .models import Cart, Order, Plants, refresh_search_vectors
+
+# every seeded or benchmark created account uses this email domain, so a new seed can remove the last one
+EMAIL_DOMAIN = "bench.example"
+BATCH_SIZE = 1000
+WORDS = ("ficus", "monstera", "fern", "palm", "succulent", "cactus", "orchid", "bonsai", "lily", "ivy", "aloe")
+
+
+def _email(kind, n):
+    return f"{kind}{n}@{EMAIL_DOMAIN}"
+
+
+def clear():
+    """removes every account seeded or created by a benchmark, with their plants, carts and orders"""
+    buyers = Buyer.objects.filter(email__endswith="@" + EMAIL_DOMAIN)
+    nurseries = Nursery.objects.filter(email__endswith="@" + EMAIL_DOMAIN)
+    with transaction.atomic():
+        Order.objects.filter(buyer__in=buyers).delete()
+        Order.objects.filter(plant__owner__in=nurseries).delete()
+        Cart.objects.filter(user__in=buyers).delete()
+        buyers.delete()
+        nurseries.delete()
+
+
+def seed(nurseries, plants, buyers, carts, orders, password, days=90, random_seed=0):
+    """
+    Creates `nurseries` nurseries owning `plants` plants between them, `buyers` buyers with `carts` cart lines
+    and `orders` orders each, spread over the last `days` days, all with `password`.
+    Replaces the previous benchmark dataset. returns {model name: rows created}
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    encoded = make_password(password)
+    clear()
+
+    nursery_rows = Nursery.objects.bulk_create(
+        [
+            Nursery(email=_email("nursery", n), password=encoded, name=f"Bench Nursery {n}", about="benchmark")
+            for n in range(nurseries)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    buyer_rows = Buyer.objects.bulk_create(
+        [Buyer(email=_email("buyer", n), password=encoded, first_name=f"Buyer {n}") for n in range(buyers)],
+        batch_size=BATCH_SIZE,
+    )
+    plant_rows = Plants.objects.bulk_create(
+        [
+            Plants(
+                name=f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {n}",
+                owner=nursery_rows[n % nurseries],
+                plant_description=" ".join(rng.choice(WORDS) for _ in range(12)),
+                price=Decimal(rng.randint(100, 99999)) / 100,
+                inStock=rng.random() < 0.8,
+                created_at=now - timedelta(seconds=rng.randint(0, days * 86400)),
+            )
+            for n in range(plants)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    refresh_search_vectors(Plants.objects.filter(owner__in=nursery_rows))
+
+    cart_rows, order_rows = [], []
+    for buyer in buyer_rows:
+        for plant in rng.sample(plant_rows, min(carts, len(plant_rows))):
+            cart_rows.append(Cart(plant=plant, user=buyer, quantity=rng.randint(1, 5), total=0))
+        for _ in range(orders):
+            plant, quantity = rng.choice(plant_rows), rng.randint(1, 5)
+            order_rows.append(
+                Order(
+                    plant=plant,
+                    buyer=buyer,
+                    nursery_id=plant.owner_id,
+                    quantity=quantity,
+                    total=plant.price * quantity,
+                    is_payed=rng.random() < 0.5,
+                    order_status=rng.choice(Order.ORDER_STATUS)[0],
+                    ordered_at=now - timedelta(seconds=rng.randint(0, days * 86400)),
+                )
+            )
+    for cart in cart_rows:
+        cart.total = cart.plant.price * cart.quantity
+    Cart.objects.bulk_create(cart_rows, batch_size=BATCH_SIZE)
+    Order.objects.bulk_create(order_rows, batch_size=BATCH_SIZE)
+    for nursery in nursery_rows:
+        analytics.rebuild(nursery.id, (now - timedelta(days=days)).date(), now.date())
+    return {
+        "nurseries": len(nursery_rows),
+        "plants": len(plant_rows),
+        "buyers": len(buyer_rows),
+        "carts": len(cart_rows),
+        "orders": len(order_rows),
+    }
+
+
+class Context:
+    """the seeded accounts and rows the scenarios pick from, plus helpers for rows a request consumes"""
+
+    def __init__(self, password):
+        self.password = password
+        self.encoded = make_password(password)
+        self.nursery = Nursery.objects.filter(email=_email("nursery", 0)).first()
+        if self.nursery is None:
+            raise RuntimeError("No benchmark data, run seed_benchmark_data first.")
+        self.buyer = Buyer.objects.get(email=_email("buyer", 0))
+        self.nursery_token = generate_token(self.nursery.id.urn, "nursery")
+        self.buyer_token = generate_token(self.buyer.id.urn, "buyer")
+        plants = Plants.objects.filter(owner=self.nursery, isDeleted=False, inStock=True)
+        self.plant_ids = [str(pk) for pk in plants.values_list("id", flat=True)]
+        self.order_ids = [str(pk) for pk in Order.objects.filter(nursery=self.nursery).values_list("id", flat=True)]
+        if not self.plant_ids or not self.order_ids:
+            raise RuntimeError("The benchmark nursery has no plants or orders, seed a larger dataset.")
+
+    def plant_id(self):
+        return random.choice(self.plant_ids)
+
+    def new_plant(self):
+        plant = Plants.objects.create(
+            name="bench disposable", owner=self.nursery, plant_description="benchmark", price=Decimal("1.00")
+        )
+        return str(plant.id)
+
+    def new_buyer(self):
+        buyer = Buyer.objects.create(
+            email=_email(f"buyer-{uuid.uuid4().hex}", ""), password=self.encoded, first_name="B"
+        )
+        return buyer, generate_token(buyer.id.urn, "buyer")
+
+    def new_nursery_token(self):
+        nursery = Nursery.objects.create(
+            email=_email(f"nursery-{uuid.uuid4().hex}", ""), password=self.encoded, name="N", about="benchmark"
+        )
+        return generate_token(nursery.id.urn, "nursery")
+
+
+class Scenario:
+    """
+    One route and method. `prepare(ctx)` runs before the timed request and returns (path, body, token);
+    body is sent as JSON, token as the Bearer credentials.
+    """
+
+    def __init__(self, name, method, prepare):
+        self.name = name
+        self.method = method
+        self.prepare = prepare
+
+
+def _cart_checkout(ctx):
+    buyer, token = ctx.new_buyer()
+    Cart.objects.create(plant_id=ctx.plant_id(), user=buyer, quantity=1, total=1)
+    return "/api/plants/checkout_cart/", None, token
+
+
+def _new_cart(ctx):
+    cart = Cart.objects.create(plant_id=ctx.plant_id(), user=ctx.buyer, quantity=1, total=1)
+    return f"/api/plants/delete_cart/{cart.id}/", None, ctx.buyer_token
+
+
+def _new_plant_json(n):
+    return {"name": f"bench plant {n}", "plant_description": "benchmark", "price": "12.50", "inStock": True}
+
+
+# plants.urls
+PLANT_SCENARIOS = [
+    Scenario(
+        "post_plant POST", "post", lambda ctx: ("/api/plants/post_plant/", _new_plant_json(0), ctx.nursery_token)
+    ),
+    Scenario("post_plant GET", "get", lambda ctx: ("/api/plants/post_plant/", None, ctx.nursery_token)),
+    Scenario(
+        "bulk_upload_plants POST",
+        "post",
+        lambda ctx: ("/api/plants/bulk_upload_plants/", [_new_plant_json(n) for n in range(20)], ctx.nursery_token),
+    ),
+    Scenario("list_plants GET", "get", lambda ctx: ("/api/plants/list_plants/", None, ctx.buyer_token)),
+    Scenario(
+        "list_plants GET filtered",
+        "get",
+        lambda ctx: (
+            "/api/plants/list_plants/?sort=price&inStock=true&min_price=10&max_price=100",
+            None,
+            ctx.buyer_token,
+        ),
+    ),
+    Scenario(
+        "search_plants GET",
+        "get",
+        lambda ctx: (f"/api/plants/search_plants/?q={random.choice(WORDS)}", None, ctx.buyer_token),
+    ),
+    Scenario(
+        "update_delete_plant GET",
+        "get",
+        lambda ctx: (f"/api/plants/update_delete_plant/{ctx.plant_id()}/", None, ctx.nursery_token),
+    ),
+    Scenario(
+        "update_delete_plant PUT",
+        "put",
+        lambda ctx: (f"/api/plants/update_delete_plant/{ctx.plant_id()}/", {"inStock": True}, ctx.nursery_token),
+    ),
+    Scenario(
+        "update_delete_plant DELETE",
+        "delete",
+        lambda ctx: (f"/api/plants/update_delete_plant/{ctx.new_plant()}/", None, ctx.nursery_token),
+    ),
+    Scenario(
+        "add_update_get_cart POST",
+        "post",
+        lambda ctx: (
+            "/api/plants/add_update_get_cart/", {"plant_id": ctx.plant_id(), "quantity": 1}, ctx.buyer_token
+        ),
+    ),
+    Scenario("add_update_get_cart GET", "get", lambda ctx: ("/api/plants/add_update_get_cart/", None, ctx.buyer_token)),
+    Scenario("delete_cart DELETE", "delete", _new_cart),
+    Scenario(
+        "place_order POST",
+        "post",
+        lambda ctx: ("/api/plants/place_order/", {"plant_id": ctx.plant_id(), "quantity": 1}, ctx.buyer_token),
+    ),
+    Scenario("place_order GET", "get", lambda ctx: ("/api/plants/place_order/", None, ctx.buyer_token)),
+    Scenario("checkout_cart POST", "post", _cart_checkout),
+    Scenario(
+        "view_received_order GET", "get", lambda ctx: ("/api/plants/view_received_order/", None, ctx.nursery_token)
+    ),
+    Scenario("sales_analytics GET", "get", lambda ctx: ("/api/plants/sales_analytics/", None, ctx.nursery_token)),
+    Scenario(
+        "update_order_status PUT",
+        "put",
+        lambda ctx: (
+            f"/api/plants/update_order_status/{random.choice(ctx.order_ids)}/",
+            {"is_payed": random.choice([True, False])},
+            ctx.nursery_token,
+        ),
+    ),
+]
+
+# user_management.urls
+USER_SCENARIOS = [
+    Scenario(
+        "register_buyer POST",
+        "post",
+        lambda ctx: (
+            "/api/auth/register_buyer/",
+            {"email": _email(f"buyer-{uuid.uuid4().hex}", ""), "password": ctx.password, "first_name": "B"},
+            None,
+        ),
+    ),
+    Scenario(
+        "login_buyer POST",
+        "post",
+        lambda ctx: ("/api/auth/login_buyer/", {"email": ctx.buyer.email, "password": ctx.password}, None),
+    ),
+    Scenario(
+        "get_update_delete_buyer GET", "get", lambda ctx: ("/api/auth/get_update_delete_buyer/", None, ctx.buyer_token)
+    ),
+    Scenario(
+        "get_update_delete_buyer PUT",
+        "put",
+        lambda ctx: ("/api/auth/get_update_delete_buyer/", {"middle_name": "bench"}, ctx.buyer_token),
+    ),
+    Scenario(
+        "get_update_delete_buyer DELETE",
+        "delete",
+        lambda ctx: ("/api/auth/get_update_delete_buyer/", None, ctx.new_buyer()[1]),
+    ),
+    Scenario(
+        "register_nursery POST",
+        "post",
+        lambda ctx: (
+            "/api/auth/register_nursery/",
+            {"email": _email(f"nursery-{uuid.uuid4().hex}", ""), "password": ctx.password, "name": "N"},
+            None,
+        ),
+    ),
+    Scenario(
+        "login_nursery POST",
+        "post",
+        lambda ctx: ("/api/auth/login_nursery/", {"email": ctx.nursery.email, "password": ctx.password}, None),
+    ),
+    Scenario(
+        "get_update_delete_nursery GET",
+        "get",
+        lambda ctx: ("/api/auth/get_update_delete_nursery/", None, ctx.nursery_token),
+    ),
+    Scenario(
+        "get_update_delete_nursery PUT",
+        "put",
+        lambda ctx: ("/api/auth/get_update_delete_nursery/", {"about": "benchmark"}, ctx.nursery_token),
+    ),
+    Scenario(
+        "get_update_delete_nursery DELETE",
+        "delete",
+        lambda ctx: ("/api/auth/get_update_delete_nursery/", None, ctx.new_nursery_token()),
+    ),
+]
+
+SCENARIOS = PLANT_SCENARIOS + USER_SCENARIOS
+
+
+def percentile(values, pct):
+    """nearest rank percentile of sorted `values`"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
+
+
+def _host():
+    # django.test.Client talks to "testserver", which ALLOWED_HOSTS doesn't know outside the test runner
+    return next((host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"), "localhost")
+
+
+class _Worker(threading.local):
+    def __init__(self):
+        # a view that raises counts as a 500 instead of stopping the run
+        self.client = Client(raise_request_exception=False, HTTP_HOST=_host())
+
+
+def request_args(prepared):
+    """(path, client kwargs) for what a scenario's prepare() returned"""
+    path, body, token = prepared
+    extra = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+    if body is not None:
+        extra.update(data=json.dumps(body), content_type="application/json")
+    return path, extra
+
+
+def clear_caches():
+    """empties the caches a request could be served from; the shared alias keeps the catalog version and revocations"""
+    principal_cache.clear()
+    catalog_cache.forget_version()
+    for alias in settings.CACHES:
+        if alias != shared_cache.ALIAS:
+            caches[alias].clear()
+
+
+def check_budget(client, ctx, scenario, threshold=N_PLUS_ONE_THRESHOLD):
+    """
+    Runs `scenario` once with `client` and checks its queries against the view's query_budget.
+    returns (queries run, budget, problems as from query_budget.check)
+    """
+    path, extra = request_args(scenario.prepare(ctx))
+    with QueryRecorder() as recorder:
+        resp = getattr(client, scenario.method)(path, **extra)
+    budget = budget_for(resolve(path.split("?")[0]).func.view_class, scenario.method)
+    problems = check(scenario.name, budget, recorder, threshold)
+    if resp.status_code >= 400:
+        problems.append([f"{scenario.name}: answered {resp.status_code}, the count may not be representative"])
+    return len(recorder), budget, problems
+
+
+def _request(worker, ctx, scenario):
+    path, extra = request_args(scenario.prepare(ctx))
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        resp = getattr(worker.client, scenario.method)(path, **extra)
+        if resp.streaming:
+            b"".join(resp.streaming_content)
+        elapsed = time.perf_counter() - started
+    return elapsed, len(queries.captured_queries), resp.status_code
+
+
+def run_scenario(ctx, scenario, requests, concurrency):
+    """runs `requests` requests of `scenario` over `concurrency` threads; returns its result dict"""
+    worker = _Worker()
+
+    def one(_):
+        try:
+            return _request(worker, ctx, scenario)
+        finally:
+            close_old_connections()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    statuses = {}
+    for _, _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": requests,
+        "errors": sum(count for status, count in statuses.items() if int(status) >= 400),
+        "statuses": statuses,
+        "throughput": requests / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "queries_mean": sum(queries) / len(queries),
+        "queries_max": max(queries),
+    }
+
+
+def git_commit():
+    try:
+        git = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        )
+        return git.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(requests, concurrency, password, only=None):
+    """runs every scenario (or those whose name contains one of `only`); returns the JSON-able report"""
+    ctx = Context(password)
+    scenarios = [s for s in SCENARIOS if not only or any(part in s.name for part in only)]
+    results = {}
+    for scenario in scenarios:
+        results[scenario.name] = run_scenario(ctx, scenario, requests, concurrency)
+    return {
+        "commit": git_commit(),
+        "created_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "requests": requests,
+        "concurrency": concurrency,
+        "dataset": {
+            "nurseries": Nursery.objects.filter(email__endswith="@" + EMAIL_DOMAIN).count(),
+            "plants": Plants.objects.filter(owner__email__endswith="@" + EMAIL_DOMAIN).count(),
+            "buyers": Buyer.objects.filter(email__endswith="@" + EMAIL_DOMAIN).count(),
+            "orders": Order.objects.filter(buyer__email__endswith="@" + EMAIL_DOMAIN).count(),
+        },
+        "results": results,
+    }
@@ -0,0 +1,97 @@
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import Signal
+
+from common_utils.metrics import count_cache
+from common_utils.shared_cache import is_shared, shared_cache
+
+CATALOG_CACHE = getattr(settings, "CATALOG_CACHE", {})
+VERSION_KEY = "catalog:version"
+VERSION_TTL = CATALOG_CACHE.get("VERSION_TTL", 5)
+
+# send from code that changes many plants at once without going through Plants.save (queryset.update, bulk_create)
+catalog_changed = Signal()
+
+# (version, time.monotonic() it stops being trusted): the last version read from the shared cache
+_local_version = (None, 0.0)
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CATALOG_CACHE.get("ALIAS", "default")]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def enabled():
+    """
+    Pages are cached only while the version lives in a shared backend: a bump has to reach every worker process,
+    with a per process backend the others would keep serving their pages.
+    """
+    return is_shared()
+
+
+def get_version():
+    """
+    the current catalog version, from the shared cache; the pages keyed by it may live in a per process one.
+    A version read is trusted for VERSION_TTL seconds, so a cached page costs no shared cache read, which with the
+    database table would be a query. Bumps in this process are seen at once, in the others within VERSION_TTL.
+    """
+    global _local_version
+    version, expires = _local_version
+    if version is not None and time.monotonic() < expires:
+        return version
+    cache = shared_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(VERSION_KEY, version, timeout=None):
+            # another process got there first
+            version = cache.get(VERSION_KEY)
+    _local_version = (version, time.monotonic() + VERSION_TTL)
+    return version
+
+
+def bump_version():
+    """Every cached page is keyed by the version, so replacing it orphans all of them at once."""
+    global _local_version
+    version = uuid.uuid4().hex
+    shared_cache().set(VERSION_KEY, version, timeout=None)
+    _local_version = (version, time.monotonic() + VERSION_TTL)
+
+
+def forget_version():
+    """drops this process's copy of the version, the next get_version() reads the shared cache"""
+    global _local_version
+    _local_version = (None, 0.0)
+
+
+def page_key(request, version):
+    params = request.query_params
+    raw = "|".join(f"{name}={value}" for name, value in sorted(params.lists()))
+    return "catalog:{0}:page:{1}".format(version, hashlib.md5(raw.encode("utf-8")).hexdigest())
+
+
+def get_page(key):
+    page = _cache().get(key)
+    _count("misses" if page is None else "hits")
+    count_cache("catalog", page is not None)
+    return page
+
+
+def set_page(key, page):
+    _cache().set(key, page, timeout=CATALOG_CACHE.get("TIMEOUT", 300))
@@ -0,0 +1,94 @@
+import uuid
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from common_utils.pagination import KeysetPaginator
+
+# ?sort= value: (column, descending). Every column has a partial index per equality filter combination
+# (see Plants.Meta.indexes), so a page is one index range scan whatever the catalog size.
+SORTS = {
+    "created": ("created_at", False),
+    "newest": ("created_at", True),
+    "price": ("price", False),
+    "-price": ("price", True),
+    "name": ("name", False),
+    "-name": ("name", True),
+}
+DEFAULT_SORT = "created"
+
+# range filters walk the sort index, so they are only accepted with a sort on the same column
+RANGE_FILTERS = {
+    "min_price": ("price", "gte"),
+    "max_price": ("price", "lte"),
+    "created_after": ("created_at", "gt"),
+}
+
+
+class UnsupportedListing(Exception):
+    pass
+
+
+def _parse_price(name, value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise UnsupportedListing(f"{name} must be a number.")
+
+
+def _parse_moment(name, value):
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise UnsupportedListing(f"{name} must be an ISO 8601 date or datetime.")
+        moment = datetime.combine(day, time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+PARSERS = {"min_price": _parse_price, "max_price": _parse_price, "created_after": _parse_moment}
+
+
+def plant_listing(request, queryset):
+    """
+    Applies the list_plants query parameters to a queryset of live plants; returns (queryset, paginator).
+        sort            created (default), newest, price, -price, name, -name
+        nursery         only this nursery's plants
+        inStock=true    only plants in stock
+        min_price, max_price    with sort=price / -price
+        created_after   with sort=created / newest
+    Anything that no index can serve raises UnsupportedListing instead of falling back to a full scan.
+    """
+    params = request.query_params
+    sort = params.get("sort", DEFAULT_SORT)
+    if sort not in SORTS:
+        raise UnsupportedListing(f"Unknown sort {sort}. Use one of: {', '.join(SORTS)}.")
+    column, descending = SORTS[sort]
+
+    nursery = params.get("nursery")
+    if nursery:
+        try:
+            queryset = queryset.filter(owner_id=uuid.UUID(nursery))
+        except ValueError:
+            raise UnsupportedListing("nursery must be a nursery id.")
+
+    in_stock = params.get("inStock")
+    if in_stock:
+        if in_stock.lower() not in ("true", "1"):
+            raise UnsupportedListing("Only inStock=true is supported.")
+        queryset = queryset.filter(inStock=True)
+
+    for name, (field, lookup) in RANGE_FILTERS.items():
+        value = params.get(name)
+        if not value:
+            continue
+        if field != column:
+            accepted = [key for key, (sort_column, _) in SORTS.items() if sort_column == field]
+            raise UnsupportedListing(f"{name} needs sort={' or sort='.join(accepted)}.")
+        queryset = queryset.filter(**{f"{field}__{lookup}": PARSERS[name](name, value)})
+
+    return queryset, KeysetPaginator(column, descending=descending)
@@ -0,0 +1,158 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .catalog_cache import catalog_changed
+from .models import FULL_SIZE, IMAGE_SIZES, Plants, image_staging_storage, image_storage, image_upload_path
+
+IMAGE_PIPELINE = settings.IMAGE_PIPELINE
+FORMAT = IMAGE_PIPELINE.get("FORMAT", "JPEG")
+QUALITY = IMAGE_PIPELINE.get("QUALITY", 82)
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+RETRIES = IMAGE_PIPELINE.get("RETRIES", 3)
+RETRY_BACKOFF = IMAGE_PIPELINE.get("RETRY_BACKOFF", 1.0)
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PIPELINE.get("WORKERS", 2), thread_name_prefix="plant-images")
+
+
+def stage_image(plant_id, upload):
+    """
+    Writes an uploaded image to staging storage and marks the plant PENDING; returns straight away.
+    Resizing and the upload to image storage happen after the transaction commits.
+    """
+    name = image_staging_storage().save(f"{plant_id}/{os.path.basename(upload.name)}", upload)
+    Plants.objects.filter(pk=plant_id).update(image_staged=name, image_status=Plants.IMAGE_PENDING)
+    if IMAGE_PIPELINE.get("IN_PROCESS", True):
+        transaction.on_commit(lambda: _executor.submit(_process_in_thread, plant_id))
+
+
+def _process_in_thread(plant_id):
+    close_old_connections()
+    try:
+        process_image(plant_id)
+    finally:
+        close_old_connections()
+
+
+def _retry(action, *args):
+    """
+    Calls action, retrying failures RETRIES times with exponential backoff: storage errors are often a network
+    blip or a rate limit. A missing file is not retried.
+    """
+    for attempt in range(RETRIES + 1):
+        try:
+            return action(*args)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            if attempt == RETRIES:
+                raise
+            delay = RETRY_BACKOFF * 2 ** attempt
+            logger.warning("%s failed (%r), retrying in %ss.", action.__name__, e, delay)
+            time.sleep(delay)
+
+
+def _read(staging, name):
+    with staging.open(name) as f:
+        return f.read()
+
+
+def _decode(data):
+    """the staged bytes as a loaded image; raises for files that are not images, where a retry cannot help"""
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    image = image.convert("RGB") if FORMAT == "JPEG" else image
+    image.load()
+    return image
+
+
+def _encode(image, edge):
+    copy = image.copy()
+    copy.thumbnail((edge, edge), Image.LANCZOS)
+    buf = BytesIO()
+    copy.save(buf, FORMAT, quality=QUALITY, optimize=True)
+    return ContentFile(buf.getvalue())
+
+
+def _delete(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.warning("Deleting image %s failed.", name, exc_info=True)
+
+
+def _store(storage, plant, image):
+    """saves every size of image, {size: name}; a failed attempt removes the sizes it had saved"""
+    extension = EXTENSIONS.get(FORMAT, "img")
+    variants = {}
+    try:
+        for size, edge in IMAGE_SIZES.items():
+            variants[size] = storage.save(image_upload_path(plant, f"{size}.{extension}"), _encode(image, edge))
+    except Exception:
+        _delete(storage, variants.values())
+        raise
+    return variants
+
+
+def process_image(plant_id):
+    """
+    Resizes the staged image of a PENDING plant into every size in IMAGE_SIZES and saves them to image storage.
+    plant_images points at the largest one, image_variants / image_urls have them all.
+    Reading the staged file and saving the sizes are retried; the plant is marked FAILED and the staged file
+    removed only once the retries are used up, or straight away when the file is not an image.
+    returns the new status, None if nothing to do
+    """
+    plant = (
+        Plants.objects.filter(pk=plant_id, image_status=Plants.IMAGE_PENDING)
+        .only("id", "image_staged", "image_variants")
+        .first()
+    )
+    if plant is None or not plant.image_staged:
+        return None
+    staging, storage = image_staging_storage(), image_storage()
+    staged = plant.image_staged
+    try:
+        image = _decode(_retry(_read, staging, staged))
+        variants = _retry(_store, storage, plant, image)
+        fields = {
+            "plant_images": variants[FULL_SIZE],
+            "image_variants": variants,
+            "image_urls": {size: storage.url(name) for size, name in variants.items()},
+        }
+        status = Plants.IMAGE_READY
+    except Exception:
+        logger.exception("Processing the image of plant %s failed, marking it %s.", plant_id, Plants.IMAGE_FAILED)
+        status, fields = Plants.IMAGE_FAILED, {}
+    # a newer upload may have been staged meanwhile, leave the plant to that one
+    updated = Plants.objects.filter(pk=plant_id, image_staged=staged).update(
+        image_status=status, image_staged=None, updated_at=timezone.now(), **fields
+    )
+    _delete(staging, [staged])
+    if status == Plants.IMAGE_READY:
+        # the sizes replaced, or the ones just made when the newer upload won
+        _delete(storage, (plant.image_variants if updated else variants).values())
+    if updated:
+        catalog_changed.send(sender=Plants)
+    return status
+
+
+def process_pending(limit=None):
+    """processes PENDING plants oldest first, for the worker command; returns {status: count}"""
+    pending = Plants.objects.filter(image_status=Plants.IMAGE_PENDING).order_by("updated_at")
+    counts = {}
+    for plant_id in pending.values_list("id", flat=True)[:limit]:
+        status = process_image(plant_id)
+        if status:
+            counts[status] = counts.get(status, 0) + 1
+    return counts
+
@@ -0,0 +1,250 @@
+import codecs
+import csv
+import json
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import SkipField, empty
+
+from .catalog_cache import catalog_changed
+from .models import SEARCH_VECTOR_SQL, Plants
+from .pricing import reprice_carts
+from .serializers import PlantsUpdateSerializer
+
+BULK_INGEST = getattr(settings, "BULK_INGEST", {})
+BATCH_SIZE = BULK_INGEST.get("BATCH_SIZE", 1000)
+MAX_ERRORS = BULK_INGEST.get("MAX_ERRORS", 1000)
+READ_SIZE = 64 * 1024
+
+# plant_images can't travel in a bulk body, everything else follows PlantsUpdateSerializer
+INGEST_FIELDS = ("name", "plant_description", "price", "inStock")
+UPDATE_FIELDS = list(INGEST_FIELDS) + ["updated_at"]
+
+
+def iter_json_array(stream):
+    """Yields the items of a top level JSON array as they are read, without loading the whole body."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, started = "", False
+    while True:
+        chunk = stream.read(READ_SIZE)
+        eof = not chunk
+        buf += utf8.decode(chunk, final=eof)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array.")
+                started, pos = True, pos + 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # item continues in the next chunk
+            yield item
+        buf = buf[pos:]
+        if eof:
+            raise ValueError("Invalid or truncated JSON array.")
+
+
+def iter_json_lines(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _blank(value):
+    # short rows give None for their missing cells
+    return value is None or isinstance(value, str) and not value.strip()
+
+
+def iter_csv(stream):
+    """rows of a CSV body; an empty cell counts as a missing field, the way a JSON row would leave it out"""
+    for row in csv.DictReader(codecs.iterdecode(stream, "utf-8-sig")):
+        yield {name: value for name, value in row.items() if not _blank(value)}
+
+
+PARSERS = {
+    "application/json": iter_json_array,
+    "application/x-ndjson": iter_json_lines,
+    "application/jsonl": iter_json_lines,
+    "text/csv": iter_csv,
+}
+
+
+def parse_upload(content_type, stream):
+    """returns an iterator of rows for the body, or None if the content type is not supported"""
+    parser = PARSERS.get((content_type or "").split(";")[0].strip().lower())
+    if parser is None:
+        return None
+    if stream is None:
+        return iter(())
+    return parser(stream)
+
+
+def _fail(result, row_number, errors):
+    result["failed"] += 1
+    if len(result["errors"]) < MAX_ERRORS:
+        result["errors"].append({"row": row_number, "errors": errors})
+
+
+def _validator_fields():
+    fields = PlantsUpdateSerializer().fields
+    return [(name, fields[name]) for name in INGEST_FIELDS]
+
+
+def _validate(fields, row):
+    """
+    Field by field PlantsUpdateSerializer validation, same rules as serializer.run_validation
+    without building a serializer per row.
+    """
+    data, errors = {}, {}
+    for name, field in fields:
+        try:
+            data[name] = field.run_validation(row.get(name, empty))
+        except SkipField:
+            pass
+        except ValidationError as e:
+            errors[name] = e.detail
+    if errors:
+        raise ValidationError(errors)
+    return data
+
+
+def _unnest(fields, plants, add):
+    """
+    `FROM unnest(...) AS v(<columns>)` and its params: one array per field, so a batch is one statement with a
+    handful of parameters whatever its size
+    """
+    qn = connection.ops.quote_name
+    arrays = ", ".join(f"%s::{field.db_type(connection)}[]" for field in fields)
+    params = [[field.get_db_prep_save(field.pre_save(plant, add), connection) for plant in plants] for field in fields]
+    return f"unnest({arrays}) AS v({', '.join(qn(field.column) for field in fields)})", params
+
+
+def _write(created, updated):
+    """
+    Inserts `created` and updates the UPDATE_FIELDS of `updated`. On PostgreSQL that is one INSERT ... SELECT and
+    one UPDATE ... FROM over unnested arrays, which also compute search_vector: no per row SQL to compile and no
+    second UPDATE rewriting every row with all its indexes.
+    """
+    if connection.vendor != "postgresql":
+        Plants.objects.bulk_create(created)
+        if updated:
+            Plants.objects.bulk_update(updated, UPDATE_FIELDS)
+        return
+    qn = connection.ops.quote_name
+    table = qn(Plants._meta.db_table)
+    vector = SEARCH_VECTOR_SQL.format(name="v.name", description="v.plant_description")
+    with connection.cursor() as cursor:
+        if created:
+            fields = [field for field in Plants._meta.concrete_fields if field.name != "search_vector"]
+            source, params = _unnest(fields, created, add=True)
+            columns = ", ".join(qn(field.column) for field in fields)
+            cursor.execute(f"INSERT INTO {table} ({columns}, search_vector) SELECT v.*, {vector} FROM {source}", params)
+        if updated:
+            fields = [Plants._meta.get_field(name) for name in ["id"] + UPDATE_FIELDS]
+            source, params = _unnest(fields, updated, add=False)
+            assignments = ", ".join(f"{qn(field.column)} = v.{qn(field.column)}" for field in fields[1:])
+            cursor.execute(
+                f"UPDATE {table} SET {assignments}, search_vector = {vector} FROM {source} WHERE {table}.id = v.id",
+                params,
+            )
+
+
+def _ingest_batch(owner_id, batch, upsert, fields, result):
+    valid = []
+    for row_number, row in batch:
+        if not isinstance(row, dict):
+            _fail(result, row_number, "Invalid row, expected an object.")
+            continue
+        sku = str(row.get("sku") or "").strip() or None
+        try:
+            data = _validate(fields, row)
+        except ValidationError as e:
+            _fail(result, row_number, e.detail)
+            continue
+        valid.append((row_number, sku, data))
+
+    skus = {sku for _, sku, _ in valid if sku}
+    existing = {}
+    if skus:
+        # deleted plants are not matched, a row with their sku creates a new plant instead of reviving them
+        live = Plants.objects.filter(owner_id=owner_id, sku__in=skus, isDeleted=False)
+        existing = {p.sku: p for p in live.only("id", "sku")}
+
+    to_create, to_update, pending = [], {}, {}
+    now = timezone.now()
+    for row_number, sku, data in valid:
+        if sku in existing:
+            if not upsert:
+                _fail(result, row_number, {"sku": ["Plant with this sku already exists."]})
+                continue
+            plant = existing[sku]
+            to_update[sku] = (row_number, plant)
+        elif sku in pending:
+            if not upsert:
+                _fail(result, row_number, {"sku": ["Duplicate sku in upload."]})
+                continue
+            plant = pending[sku][1]
+        else:
+            plant = Plants(owner_id=owner_id, sku=sku)
+            to_create.append((row_number, plant))
+            if sku:
+                pending[sku] = (row_number, plant)
+        for field, value in data.items():
+            setattr(plant, field, value)
+        plant.updated_at = now
+
+    written = [plant for _, plant in to_create] + [plant for _, plant in to_update.values()]
+    if not written:
+        return
+    try:
+        with transaction.atomic():
+            _write([plant for _, plant in to_create], [plant for _, plant in to_update.values()])
+            if to_update:
+                reprice_carts([plant.pk for _, plant in to_update.values()])
+    except DatabaseError as e:
+        for row_number, _ in to_create + list(to_update.values()):
+            _fail(result, row_number, str(e))
+        return
+    result["created"] += len(to_create)
+    result["updated"] += len(to_update)
+
+
+def ingest_plants(owner_id, rows, upsert=False, batch_size=BATCH_SIZE):
+    """
+    Validates and writes plants for a nursery in batches of `batch_size`, one transaction per batch.
+    Rows with the sku of one of the nursery's live plants are rejected, or update it in place when `upsert` is set.
+    Deleted plants are never matched or revived.
+    returns {"created", "updated", "failed", "errors": [{"row": <1 based row number>, "errors": ...}]}
+    """
+    result = {"created": 0, "updated": 0, "failed": 0, "errors": []}
+    fields = _validator_fields()
+    batch, row_number = [], 0
+    try:
+        for row_number, row in enumerate(rows, start=1):
+            batch.append((row_number, row))
+            if len(batch) >= batch_size:
+                _ingest_batch(owner_id, batch, upsert, fields, result)
+                batch = []
+    except (ValueError, csv.Error) as e:
+        _fail(result, row_number + 1, str(e))
+    if batch:
+        _ingest_batch(owner_id, batch, upsert, fields, result)
+    if result["created"] or result["updated"]:
+        catalog_changed.send(sender=Plants)
+    return result
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from plants.models import Order, Plants
+
+
+class Command(BaseCommand):
+    help = "Fill Order.nursery from the plant owner for orders placed before the column existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        owner = Subquery(Plants.objects.filter(pk=OuterRef("plant_id")).order_by().values("owner_id")[:1])
+        total = 0
+        while True:
+            ids = list(Order.objects.filter(nursery__isnull=True).values_list("id", flat=True)[: options["batch_size"]])
+            if not ids:
+                break
+            total += Order.objects.filter(id__in=ids).update(nursery_id=owner)
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {total} order(s)."))
@@ -0,0 +1,59 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from common_utils.renderers import FastJSONRenderer
+from plants.projections import PLANT_LIST
+
+
+def catalog_payload(rows):
+    """a list_plants style envelope of `rows` plants, built in memory"""
+    owners = [(uuid.uuid4(), f"Nursery {i}", f"nursery{i}@example.com") for i in range(100)]
+    now = timezone.now()
+    data = []
+    for i in range(rows):
+        owner_id, owner_name, owner_email = owners[i % len(owners)]
+        values = (
+            uuid.uuid4(),
+            f"Plant {i} – Ficus lyrata",
+            owner_id,
+            owner_name,
+            owner_email,
+            f"https://res.cloudinary.com/demo/image/upload/files/plants/images/user_{i}/thumb.jpg",
+            "Fiddle leaf fig, bright indirect light, water weekly. " * 2,
+            Decimal(i % 99999) / 100,
+            bool(i % 3),
+        )
+        data.append(dict(zip(PLANT_LIST.names, values)))
+    return {"status": True, "message": "Retreived list of plants.", "data": data, "paging": {"created_at": now}}
+
+
+class Command(BaseCommand):
+    help = "Compare JSONRenderer and FastJSONRenderer on a list_plants payload, output must be identical."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        payload = catalog_payload(options["rows"])
+        results = {}
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            best = None
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                body = renderer.render(payload, "application/json", {})
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[type(renderer).__name__] = (best, body)
+        (slow, slow_body), (fast, fast_body) = results.values()
+        if slow_body != fast_body:
+            raise CommandError("Renderers produced different output.")
+        self.stdout.write(f"{options['rows']} plants, {len(fast_body) / 1e6:.1f} MB, best of {options['repeat']}")
+        for name, (best, _) in results.items():
+            self.stdout.write(f"  {name:<18} {best * 1000:8.1f} ms")
+        self.stdout.write(self.style.SUCCESS(f"  speedup            {slow / fast:8.1f}x"))
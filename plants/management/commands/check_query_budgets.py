@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from common_utils.query_budget import N_PLUS_ONE_THRESHOLD
+from plants.benchmark import SCENARIOS, Context, _Worker, check_budget, clear_caches
+
+
+class Command(BaseCommand):
+    help = (
+        "Run every route once against the seed_benchmark_data dataset, with cold caches, and fail when a view "
+        "runs more queries than its query_budget or repeats a statement (N+1). Meant for CI next to the tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--password", default="bench-password", help="the one given to seed_benchmark_data")
+        parser.add_argument("--threshold", type=int, default=N_PLUS_ONE_THRESHOLD, help="repeats that count as N+1")
+        parser.add_argument("--only", nargs="*", help="check routes whose name contains any of these")
+        parser.add_argument("--warm", action="store_true", help="keep caches between routes")
+
+    def handle(self, *args, **options):
+        try:
+            ctx = Context(options["password"])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+        worker = _Worker()
+        failed = 0
+        for scenario in SCENARIOS:
+            if options["only"] and not any(part in scenario.name for part in options["only"]):
+                continue
+            if not options["warm"]:
+                clear_caches()
+            queries, budget, problems = check_budget(worker.client, ctx, scenario, options["threshold"])
+            if problems:
+                failed += 1
+                for lines in problems:
+                    self.stdout.write(self.style.ERROR(lines[0]))
+                    for line in lines[1:]:
+                        self.stdout.write(line)
+            else:
+                self.stdout.write(f"{scenario.name:<34} {queries:>3} / {budget}")
+        if failed:
+            raise CommandError(f"{failed} route(s) over budget or with repeated queries.")
+        self.stdout.write(self.style.SUCCESS("All routes within their query budgets."))
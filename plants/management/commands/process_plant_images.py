@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from plants.images import process_pending
+
+
+class Command(BaseCommand):
+    help = "Resize and store staged plant images, for uploads left PENDING or when IMAGE_IN_PROCESS is off."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--watch", action="store_true", help="keep polling for new uploads")
+        parser.add_argument("--interval", type=float, default=2, help="seconds between polls with --watch")
+
+    def handle(self, *args, **options):
+        while True:
+            counts = process_pending()
+            if counts:
+                self.stdout.write(", ".join(f"{count} {status.lower()}" for status, count in counts.items()))
+            if not options["watch"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from plants.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollup from orders, for everything or a nursery and date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nursery", help="nursery id")
+        parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD")
+        parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ("date_from", "date_to"):
+            if options[name]:
+                dates[name] = parse_date(options[name])
+                if dates[name] is None:
+                    raise CommandError(f"Invalid date {options[name]}")
+        written = rebuild(nursery_id=options["nursery"], **dates)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} daily sales row(s)."))
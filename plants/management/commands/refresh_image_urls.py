@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from plants.catalog_cache import catalog_changed
+from plants.models import Plants, image_urls
+
+
+class Command(BaseCommand):
+    help = "Store public image urls on plants uploaded before urls were stored, or on every plant after a storage move."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="recompute every plant, not only missing ones")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        plants = Plants.objects.exclude(Q(plant_images__isnull=True) | Q(plant_images=""))
+        if not options["all"]:
+            plants = plants.filter(image_urls={})
+        plants = plants.only("id", "plant_images", "image_variants").order_by("id")
+        batch, total = [], 0
+        for plant in plants.iterator(chunk_size=options["batch_size"]):
+            plant.image_urls = image_urls(plant)
+            batch.append(plant)
+            if len(batch) >= options["batch_size"]:
+                Plants.objects.bulk_update(batch, ["image_urls"])
+                total, batch = total + len(batch), []
+        if batch:
+            Plants.objects.bulk_update(batch, ["image_urls"])
+            total += len(batch)
+        catalog_changed.send(sender=Plants)
+        self.stdout.write(self.style.SUCCESS(f"Stored image urls for {total} plant(s)."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from plants.pricing import reprice_carts
+
+
+class Command(BaseCommand):
+    help = "Recompute cart totals from current plant prices."
+
+    def add_arguments(self, parser):
+        parser.add_argument("plant_ids", nargs="*", help="only carts holding these plants (default: all carts)")
+
+    def handle(self, *args, **options):
+        updated = reprice_carts(options["plant_ids"] or None)
+        self.stdout.write(self.style.SUCCESS(f"Repriced {updated} cart(s)."))
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from plants.benchmark import run
+
+COLUMNS = ("p50_ms", "p95_ms", "p99_ms", "throughput", "queries_mean")
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every API route with concurrent clients against the seed_benchmark_data dataset and report "
+        "latency percentiles, throughput and queries per request. --output saves the report as JSON, "
+        "--compare prints the change against a saved one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="per route")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--password", default="bench-password", help="the one given to seed_benchmark_data")
+        parser.add_argument("--only", nargs="*", help="run routes whose name contains any of these")
+        parser.add_argument("--output", help="write the JSON report to this file")
+        parser.add_argument("--compare", help="JSON report of an earlier run")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as f:
+                    baseline = json.load(f)["results"]
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+        try:
+            report = run(options["requests"], options["concurrency"], options["password"], only=options["only"])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f"{report['database']} @ {report['commit']}, {report['requests']} requests per route, "
+            f"concurrency {report['concurrency']}, dataset {report['dataset']}"
+        )
+        headers = ("p50 ms", "p95 ms", "p99 ms", "req/s", "queries")
+        self.stdout.write(f"{'route':<34}" + "".join(f"{header:>9}" for header in headers) + f"{'errors':>8}")
+        for name, result in report["results"].items():
+            self.stdout.write(
+                f"{name:<34}" + "".join(f"{result[column]:>9.1f}" for column in COLUMNS) + f"{result['errors']:>8}"
+            )
+            before = (baseline or {}).get(name)
+            if before:
+                self.stdout.write(
+                    f"{'  vs baseline':<34}"
+                    + "".join(f"{_change(before[column], result[column]):>9}" for column in COLUMNS)
+                )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved {options['output']}"))
+
+
+def _change(before, after):
+    if not before:
+        return "-"
+    return f"{(after - before) / before * 100:+.0f}%"
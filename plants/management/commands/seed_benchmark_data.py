@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from plants.benchmark import EMAIL_DOMAIN, seed
+
+
+class Command(BaseCommand):
+    help = f"Replace the benchmark dataset (accounts @{EMAIL_DOMAIN}) with a fresh one for run_benchmarks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--nurseries", type=int, default=20)
+        parser.add_argument("--plants", type=int, default=10000, help="in total, spread over the nurseries")
+        parser.add_argument("--buyers", type=int, default=200)
+        parser.add_argument("--carts", type=int, default=3, help="cart lines per buyer")
+        parser.add_argument("--orders", type=int, default=20, help="orders per buyer")
+        parser.add_argument("--days", type=int, default=90, help="plants and orders are spread over this many days")
+        parser.add_argument("--password", default="bench-password")
+        parser.add_argument("--seed", type=int, default=0, help="random seed, the same seed gives the same data")
+
+    def handle(self, *args, **options):
+        created = seed(
+            nurseries=options["nurseries"],
+            plants=options["plants"],
+            buyers=options["buyers"],
+            carts=options["carts"],
+            orders=options["orders"],
+            password=options["password"],
+            days=options["days"],
+            random_seed=options["seed"],
+        )
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{count} {name}" for name, count in created.items())))
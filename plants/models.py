@@ -1,4 +1,10 @@
-from django.db import models
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.db import connection, models
+from django.db.models import DecimalField, ExpressionWrapper, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
 from django.utils.translation import ugettext_lazy as _
 import uuid
 from user_management.models import Nursery, Buyer
@@ -9,30 +15,181 @@ def image_upload_path(instance, filename):
     return "files/plants/images/user_{0}/{1}".format(instance.id, filename)
 
 
+def image_storage():
+    """where processed plant images live, IMAGE_PIPELINE["STORAGE"] or DEFAULT_FILE_STORAGE"""
+    return get_storage_class(settings.IMAGE_PIPELINE.get("STORAGE"))()
+
+
+IMAGE_SIZES = settings.IMAGE_PIPELINE.get("SIZES", {"thumb": 160, "medium": 480, "large": 1280})
+THUMBNAIL_SIZE = min(IMAGE_SIZES, key=IMAGE_SIZES.get)
+FULL_SIZE = max(IMAGE_SIZES, key=IMAGE_SIZES.get)
+
+
+def image_urls(plant):
+    """
+    {size: public url} for a plant's processed images. Plants uploaded before image processing have one
+    original, which stands in for every size.
+    """
+    storage = image_storage()
+    if plant.image_variants:
+        return {size: storage.url(name) for size, name in plant.image_variants.items()}
+    if plant.plant_images:
+        url = storage.url(plant.plant_images.name)
+        return {size: url for size in IMAGE_SIZES}
+    return {}
+
+
+def image_staging_storage():
+    """
+    where uploads wait until plants.images has processed them: IMAGE_PIPELINE["STAGING_STORAGE"], or local disk
+    under STAGING_DIR, which only processes on the same machine can read
+    """
+    if settings.IMAGE_PIPELINE.get("STAGING_STORAGE"):
+        return get_storage_class(settings.IMAGE_PIPELINE["STAGING_STORAGE"])()
+    return FileSystemStorage(location=settings.IMAGE_PIPELINE["STAGING_DIR"])
+
+
+def plant_search_vector():
+    return SearchVector("name", weight="A", config="english") + SearchVector(
+        "plant_description", weight="B", config="english"
+    )
+
+
+# plant_search_vector as plain SQL over any two text expressions, for statements that compute the vector while they
+# write the row: compiling SearchVector expressions per row costs more than the database spends on the vectors
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english'::regconfig, COALESCE({name}, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, COALESCE({description}, '')), 'B')"
+)
+
+
+def search_vector_for(plant):
+    """
+    Assigned to plant.search_vector, the vector is computed by the INSERT / UPDATE that saves the row, no second
+    statement. None on other backends.
+    """
+    if connection.vendor != "postgresql":
+        return None
+    sql = SEARCH_VECTOR_SQL.format(name="%s", description="%s")
+    return RawSQL(sql, (plant.name, plant.plant_description), output_field=SearchVectorField())
+
+
+def refresh_search_vectors(queryset):
+    # tsvector is Postgres only, other backends leave search_vector empty
+    if connection.vendor == "postgresql":
+        queryset.update(search_vector=plant_search_vector())
+
+
+def line_total(plant_id, quantity):
+    """
+    price * quantity as a SQL expression, so a Cart/Order write computes its total in the same statement
+    instead of loading the plant first.
+    """
+    price = Subquery(Plants.objects.filter(pk=plant_id).order_by().values("price")[:1])
+    return ExpressionWrapper(price * Value(quantity), output_field=DecimalField(max_digits=1000, decimal_places=2))
+
+
 class Plants(models.Model):
+    IMAGE_PENDING = "PENDING"
+    IMAGE_READY = "READY"
+    IMAGE_FAILED = "FAILED"
+    IMAGE_STATUS_CHOICES = (
+        (IMAGE_PENDING, "Pending"),
+        (IMAGE_READY, "Ready"),
+        (IMAGE_FAILED, "Failed"),
+    )
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_index=True)
     name = models.CharField(_("Plant Name"), max_length=100, blank=False, null=False)
     owner = models.ForeignKey(Nursery, blank=False, null=False, on_delete=models.CASCADE)
-    plant_images = models.FileField(upload_to=image_upload_path, blank=True, null=True)
+    plant_images = models.FileField(upload_to=image_upload_path, storage=image_storage, blank=True, null=True)
+    # {size name: storage name} of the resized copies, filled by plants.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # image_urls(), stored so listings read urls with the row instead of building one per plant
+    image_urls = models.JSONField(default=dict, blank=True, editable=False)
+    image_staged = models.CharField(max_length=255, blank=True, null=True, editable=False)
+    image_status = models.CharField(
+        max_length=10, choices=IMAGE_STATUS_CHOICES, blank=True, null=True, editable=False, db_index=True
+    )
     plant_description = models.TextField(_("Plant Description"), max_length=200)
     price = models.DecimalField(max_digits=5, decimal_places=2, blank=False, null=False)
     inStock = models.BooleanField(default=True)
     isDeleted = models.BooleanField(default=False, db_index=True)
+    sku = models.CharField(_("SKU"), max_length=64, blank=True, null=True, help_text="Nursery supplied stock keeping unit")
+    search_vector = SearchVectorField(null=True, editable=False)
 
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [
+            # list_plants and post_plant listings only ever read live plants
+            models.Index(fields=["created_at", "id"], condition=Q(isDeleted=False), name="plants_live_created_idx"),
+            models.Index(
+                fields=["owner", "created_at", "id"], condition=Q(isDeleted=False), name="plants_owner_live_idx"
+            ),
+            # list_plants sorts (plants.filters), for all plants or one nursery's, and in stock only
+            models.Index(fields=["price", "id"], condition=Q(isDeleted=False), name="plants_live_price_idx"),
+            models.Index(fields=["name", "id"], condition=Q(isDeleted=False), name="plants_live_name_idx"),
+            models.Index(fields=["owner", "price", "id"], condition=Q(isDeleted=False), name="plants_owner_price_idx"),
+            models.Index(fields=["owner", "name", "id"], condition=Q(isDeleted=False), name="plants_owner_name_idx"),
+            models.Index(
+                fields=["created_at", "id"], condition=Q(isDeleted=False, inStock=True), name="plants_stock_created_idx"
+            ),
+            models.Index(
+                fields=["price", "id"], condition=Q(isDeleted=False, inStock=True), name="plants_stock_price_idx"
+            ),
+            models.Index(
+                fields=["name", "id"], condition=Q(isDeleted=False, inStock=True), name="plants_stock_name_idx"
+            ),
+            models.Index(
+                fields=["owner", "created_at", "id"],
+                condition=Q(isDeleted=False, inStock=True),
+                name="plants_owner_stock_created_idx",
+            ),
+            models.Index(
+                fields=["owner", "price", "id"],
+                condition=Q(isDeleted=False, inStock=True),
+                name="plants_owner_stock_price_idx",
+            ),
+            models.Index(
+                fields=["owner", "name", "id"],
+                condition=Q(isDeleted=False, inStock=True),
+                name="plants_owner_stock_name_idx",
+            ),
+            GinIndex(fields=["search_vector"], name="plants_search_vector_gin"),
+            # needs the pg_trgm extension, see README
+            GinIndex(fields=["name"], name="plants_name_trgm_gin", opclasses=["gin_trgm_ops"]),
+        ]
+        constraints = [
+            # deleted plants keep their sku, a new upload may reuse it
+            models.UniqueConstraint(
+                fields=["owner", "sku"], condition=Q(sku__isnull=False, isDeleted=False), name="plants_owner_sku_unique"
+            ),
+        ]
         verbose_name = _("Nursery - Plants")
         verbose_name_plural = _("Nursery - Plants")
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        vector = None
+        if update_fields is None or {"name", "plant_description"} & set(update_fields):
+            vector = search_vector_for(self)
+        if vector is not None:
+            self.search_vector = vector
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"search_vector"}
+        super(Plants, self).save(*args, **kwargs)
+        if vector is not None:
+            # computed by the database, drop the expression so it is read back only if somebody asks
+            del self.__dict__["search_vector"]
+
     def get_image_path(self):
-        if not self.plant_images:
-            return None
-        return self.plant_images.url
+        return self.image_urls.get(FULL_SIZE)
 
 
 class Cart(models.Model):
@@ -43,9 +200,11 @@ class Cart(models.Model):
     total = models.DecimalField(max_digits=1000, decimal_places=2, default=0.00)
 
     created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("created_at",)
+        indexes = [models.Index(fields=["user", "created_at", "id"])]
         verbose_name = _("Nursery - Carts")
         verbose_name_plural = _("Nursery - Carts")
 
@@ -53,8 +212,10 @@ class Cart(models.Model):
         return f"{self.id}"
 
     def save(self, *args, **kwargs):
-        self.total = self.plant.price * self.quantity
+        self.total = line_total(self.plant_id, self.quantity)
         super(Cart, self).save(*args, **kwargs)
+        # total was computed by the database, drop the expression so it is read back only if somebody asks
+        del self.__dict__["total"]
 
 
 class Order(models.Model):
@@ -73,15 +234,22 @@ class Order(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False, db_index=True)
     plant = models.ForeignKey(Plants, on_delete=models.CASCADE, blank=False, null=False)
     buyer = models.ForeignKey(Buyer, on_delete=models.Case, blank=False, null=False, help_text="Buyer")
+    # copy of plant.owner, set when the order is placed so the nursery inbox doesn't join through Plants
+    nursery = models.ForeignKey(Nursery, on_delete=models.CASCADE, null=True, blank=True, editable=False)
     quantity = models.PositiveIntegerField()
     total = models.DecimalField(max_digits=1000, decimal_places=2, default=0.00)
     is_payed = models.BooleanField(default=False)
     order_status = models.CharField(_("Order Status"), max_length=10, choices=ORDER_STATUS, default=PENDING)
 
     ordered_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("ordered_at",)
+        indexes = [
+            models.Index(fields=["nursery", "-ordered_at", "-id"], name="order_nursery_ordered_idx"),
+            models.Index(fields=["buyer", "ordered_at", "id"], name="order_buyer_ordered_idx"),
+        ]
         verbose_name = _("Nursery - Orders")
         verbose_name_plural = _("Nursery - Orders")
 
@@ -89,5 +257,45 @@ class Order(models.Model):
         return f"{self.id}"
 
     def save(self, *args, **kwargs):
-        self.total = self.plant.price * self.quantity
-        super(Order, self).save(*args, **kwargs)
\ No newline at end of file
+        if not self._state.adding:
+            # total is fixed when the order is placed, later price changes don't touch it
+            return super(Order, self).save(*args, **kwargs)
+        self.total = line_total(self.plant_id, self.quantity)
+        nursery_from_plant = self.nursery_id is None
+        if nursery_from_plant:
+            self.nursery_id = Subquery(Plants.objects.filter(pk=self.plant_id).order_by().values("owner_id")[:1])
+        super(Order, self).save(*args, **kwargs)
+        del self.__dict__["total"]
+        if nursery_from_plant:
+            del self.__dict__["nursery_id"]
+
+
+class DailyPlantSales(models.Model):
+    """
+    Per nursery, plant and day rollup of orders, kept up to date by plants.analytics as orders are placed
+    and updated. Rebuilt from Order with the rebuild_sales_analytics command.
+    revenue and quantity leave out cancelled orders, paid_revenue counts paid orders only.
+    """
+
+    nursery = models.ForeignKey(Nursery, on_delete=models.CASCADE)
+    plant = models.ForeignKey(Plants, on_delete=models.CASCADE)
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    quantity = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=1000, decimal_places=2, default=0)
+    paid_revenue = models.DecimalField(max_digits=1000, decimal_places=2, default=0)
+    pending_orders = models.PositiveIntegerField(default=0)
+    confirmed_orders = models.PositiveIntegerField(default=0)
+    on_the_way_orders = models.PositiveIntegerField(default=0)
+    delivered_orders = models.PositiveIntegerField(default=0)
+    cancelled_orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ("day",)
+        constraints = [models.UniqueConstraint(fields=["plant", "day"], name="daily_sales_plant_day_unique")]
+        indexes = [models.Index(fields=["nursery", "day"], name="daily_sales_nursery_day_idx")]
+        verbose_name = _("Nursery - Daily Sales")
+        verbose_name_plural = _("Nursery - Daily Sales")
+
+    def __str__(self):
+        return f"{self.plant_id} {self.day}"
@@ -0,0 +1,20 @@
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Cart, Plants
+
+
+def reprice_carts(plant_ids=None):
+    """
+    Recomputes Cart.total from the current plant price in one UPDATE.
+    Limited to carts holding `plant_ids` when given, every cart otherwise. returns the number of carts updated
+    """
+    carts = Cart.objects.all()
+    if plant_ids is not None:
+        carts = carts.filter(plant_id__in=plant_ids)
+    price = Subquery(Plants.objects.filter(pk=OuterRef("plant_id")).order_by().values("price")[:1])
+    return carts.update(
+        total=ExpressionWrapper(price * F("quantity"), output_field=DecimalField(max_digits=1000, decimal_places=2)),
+        # update() skips auto_now, the cart list validators (common_utils.conditional) read it
+        updated_at=timezone.now(),
+    )
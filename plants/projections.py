@@ -0,0 +1,57 @@
+from common_utils.projection import Column, Projection
+
+from .models import FULL_SIZE, THUMBNAIL_SIZE
+
+# list_plants, post_plant and search_plants items
+PLANT_LIST = Projection(
+    id="id",
+    name="name",
+    owner_id="owner_id",
+    owner_name="owner__name",
+    owner_email="owner__email",
+    plant_images=f"image_urls__{THUMBNAIL_SIZE}",
+    plant_description="plant_description",
+    price="price",
+    inStock="inStock",
+)
+
+# update_delete_plant, same output as PlantsSerializer
+PLANT_DETAIL = Projection(
+    id="id",
+    name="name",
+    owner="owner_id",
+    get_image_path=f"image_urls__{FULL_SIZE}",
+    plant_description="plant_description",
+    price=Column("price", str),
+    inStock="inStock",
+    isDeleted="isDeleted",
+    sku="sku",
+    image_status="image_status",
+)
+
+CART_LIST = Projection.of(
+    "id",
+    "plant_id",
+    "plant__name",
+    "plant__owner_id",
+    "plant__owner__name",
+    "plant__owner__email",
+    "total",
+    "created_at",
+)
+
+ORDER_LIST = Projection.of(
+    "id",
+    "buyer_id",
+    "buyer__first_name",
+    "buyer__email",
+    "plant_id",
+    "plant__name",
+    "plant__owner_id",
+    "plant__owner__name",
+    "plant__owner__email",
+    "total",
+    "is_payed",
+    "order_status",
+    "ordered_at",
+)
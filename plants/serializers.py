@@ -16,6 +16,8 @@ class PlantsSerializer(serializers.ModelSerializer):
             "price",
             "inStock",
             "isDeleted",
+            "sku",
+            "image_status",
         )
 
 
@@ -24,7 +26,6 @@ class PlantsUpdateSerializer(serializers.ModelSerializer):
         model = Plants
         fields = (
             "name",
-            "plant_images",
             "plant_description",
             "price",
             "inStock",
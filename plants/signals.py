@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from user_management.models import Nursery
+
+from .catalog_cache import bump_version, catalog_changed
+from .models import Plants
+
+
+# list_plants rows embed the owner's name and email, so nursery changes invalidate the catalog too.
+# The bump waits for the commit: bumped earlier, a concurrent list could cache the old rows under the new version.
+@receiver(post_save, sender=Plants)
+@receiver(post_delete, sender=Plants)
+@receiver(post_delete, sender=Nursery)
+@receiver(catalog_changed)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Nursery)
+def invalidate_catalog_for_nursery(sender, created, **kwargs):
+    # a new nursery has no plants to list yet
+    if not created:
+        transaction.on_commit(bump_version)
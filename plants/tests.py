@@ -1,3 +1,357 @@
-from django.test import TestCase
+import random
+import tempfile
+import time
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.postgres.search import SearchQuery
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from django.db.models import Q
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from common_utils.custom_auth import generate_token
+from user_management.models import Buyer, Nursery
+
+from . import analytics, benchmark, catalog_cache, images
+from .ingest import ingest_plants, parse_upload
+from .models import Cart, DailyPlantSales, Order, Plants, refresh_search_vectors
+from .pricing import reprice_carts
+
+FAST_HASHER = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+WORDS = ("ficus", "monstera", "fern", "palm", "orchid", "bonsai", "lily", "ivy", "aloe", "cactus")
+
+
+def _words(rng, low, high):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+@skipUnless(connection.vendor == "postgresql", "search_plants needs PostgreSQL with pg_trgm")
+class SearchPlantsPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        nursery = Nursery.objects.create(email="nursery@search.test", password="x", name="N", about="a")
+        buyer = Buyer.objects.create(email="buyer@search.test", password="x", first_name="B")
+        cls.token = generate_token(buyer.id.urn, "buyer")
+        # many plants per distinct score, so pages have to break ties on id
+        Plants.objects.bulk_create(
+            [
+                Plants(
+                    name=f"{_words(rng, 1, 3)} {n}",
+                    owner=nursery,
+                    plant_description=_words(rng, 3, 20),
+                    price=Decimal("5.00"),
+                )
+                for n in range(1500)
+            ]
+        )
+        refresh_search_vectors(Plants.objects.all())
+
+    def test_pages_return_every_match_once(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        ids, cursor = [], None
+        for _ in range(200):
+            url = "/api/plants/search_plants/?q=fern&limit=20" + (f"&cursor={cursor}" if cursor else "")
+            body = self.client.get(url).json()
+            self.assertTrue(body["status"], body["message"])
+            ids += [row["id"] for row in body["data"]]
+            cursor = body["paging"]["next"]
+            if cursor is None:
+                break
+        else:
+            self.fail("paging did not end")
+
+        query = SearchQuery("fern", search_type="websearch", config="english")
+        matches = Plants.objects.filter(Q(search_vector=query) | Q(name__trigram_similar="fern"), inStock=True)
+        self.assertGreater(len(ids), 1000)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {str(pk) for pk in matches.values_list("id", flat=True)})
+
+
+class ConditionalGetTests(APITransactionTestCase):
+    """a transaction test case: catalog version bumps wait for the commit"""
+
+    def setUp(self):
+        self.nursery = Nursery.objects.create(email="nursery@etag.test", password="x", name="Old name", about="a")
+        self.plant = Plants.objects.create(name="fern", owner=self.nursery, plant_description="d", price=Decimal("5.00"))
+        buyer = Buyer.objects.create(email="buyer@etag.test", password="x", first_name="B")
+        Cart.objects.create(plant=self.plant, user=buyer, quantity=2)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {generate_token(buyer.id.urn, 'buyer')}")
+
+    def assertChangedAfter(self, url, change):
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()["data"]
+
+    def rename_nursery(self):
+        self.nursery.name = "New name"
+        self.nursery.save()
+
+    def test_list_plants_cached_page_runs_no_queries(self):
+        catalog_cache.forget_version()
+        first = self.client.get("/api/plants/list_plants/").json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/plants/list_plants/").json(), first)
+
+    def test_list_plants_follows_nursery_rename(self):
+        data = self.assertChangedAfter("/api/plants/list_plants/", self.rename_nursery)
+        self.assertEqual(data[0]["owner_name"], "New name")
+
+    def test_list_plants_follows_nursery_delete(self):
+        def delete():
+            client = APIClient(HTTP_AUTHORIZATION=f"Bearer {generate_token(self.nursery.id.urn, 'nursery')}")
+            self.assertEqual(client.delete("/api/auth/get_update_delete_nursery/").status_code, 200)
+
+        self.assertEqual(self.assertChangedAfter("/api/plants/list_plants/", delete), [])
+
+    def test_cart_deleting_an_older_line_is_not_modified_since(self):
+        newer = Plants.objects.create(name="palm", owner=self.nursery, plant_description="d", price=Decimal("7.00"))
+        self.client.post("/api/plants/add_update_get_cart/", {"plant_id": str(newer.id), "quantity": 1}, format="json")
+        resp = self.client.get("/api/plants/add_update_get_cart/")
+        self.assertNotIn("Last-Modified", resp)
+        older = Cart.objects.get(plant=self.plant)
+        self.assertEqual(self.client.delete(f"/api/plants/delete_cart/{older.id}/").status_code, 200)
+        resp = self.client.get("/api/plants/add_update_get_cart/", HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([row["plant__name"] for row in resp.json()["data"]], ["palm"])
+
+    def test_cart_follows_nursery_rename(self):
+        data = self.assertChangedAfter("/api/plants/add_update_get_cart/", self.rename_nursery)
+        self.assertEqual(data[0]["plant__owner__name"], "New name")
+
+
+class IngestTests(APITestCase):
+    def setUp(self):
+        self.nursery = Nursery.objects.create(email="nursery@ingest.test", password="x", name="N", about="a")
+
+    def ingest(self, rows, upsert=False):
+        result = ingest_plants(self.nursery.id, iter(rows), upsert=upsert, batch_size=2)
+        self.assertEqual(result["errors"], [])
+        return result
+
+    def row(self, sku, name):
+        return {"sku": sku, "name": name, "plant_description": f"{name} care notes", "price": "5.00"}
+
+    def test_upsert_updates_live_plants_and_skips_deleted_ones(self):
+        self.ingest([self.row("A", "fern"), self.row("B", "palm"), self.row("C", "ivy")])
+        Plants.objects.filter(sku="B").update(isDeleted=True)
+        result = self.ingest([self.row("A", "orchid"), self.row("B", "cactus")], upsert=True)
+        self.assertEqual((result["created"], result["updated"]), (1, 1))
+        self.assertEqual(
+            sorted(Plants.objects.values_list("sku", "name", "isDeleted")),
+            [("A", "orchid", False), ("B", "cactus", False), ("B", "palm", True), ("C", "ivy", False)],
+        )
+
+    def test_csv_empty_cells_are_missing_fields(self):
+        body = "\n".join(
+            ["sku,name,plant_description,price,inStock", "A,fern,d,5.00,", "B,palm,d,6.00,false", "C,ivy,d,7.00, "]
+        )
+        self.ingest(parse_upload("text/csv", BytesIO(body.encode())))
+        self.assertEqual(sorted(Plants.objects.values_list("sku", "inStock")), [("A", True), ("B", False), ("C", True)])
+
+    @skipUnless(connection.vendor == "postgresql", "search_vector is PostgreSQL only")
+    def test_search_vector_written_with_the_row(self):
+        self.ingest([self.row("A", "fern"), self.row("B", "palm"), self.row("C", "ivy")])
+        self.ingest([self.row("A", "orchid")], upsert=True)
+        plant = Plants.objects.create(name="bonsai", owner=self.nursery, plant_description="d", price=Decimal("1"))
+        plant.name = "aloe"
+        plant.save()
+        expected = {"orchid": ["A"], "fern": [], "palm": ["B"], "aloe": [None], "bonsai": []}
+        for word, skus in expected.items():
+            found = Plants.objects.filter(search_vector=SearchQuery(word, config="english"))
+            self.assertEqual(list(found.values_list("sku", flat=True)), skus, word)
+
+
+class RepriceCartsTests(APITestCase):
+    def test_reprice_moves_total_and_updated_at(self):
+        nursery = Nursery.objects.create(email="nursery@price.test", password="x", name="N", about="a")
+        buyer = Buyer.objects.create(email="buyer@price.test", password="x", first_name="B")
+        plant = Plants.objects.create(name="fern", owner=nursery, plant_description="d", price=Decimal("5.00"))
+        cart = Cart.objects.create(plant=plant, user=buyer, quantity=3)
+        before = Cart.objects.get(pk=cart.pk).updated_at
+        Plants.objects.filter(pk=plant.pk).update(price=Decimal("7.00"))
+        self.assertEqual(reprice_carts([plant.pk]), 1)
+        cart = Cart.objects.get(pk=cart.pk)
+        self.assertEqual(cart.total, Decimal("21.00"))
+        self.assertGreater(cart.updated_at, before)
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        self.nursery = Nursery.objects.create(email="nursery@sales.test", password="x", name="N", about="a")
+        self.plants = Plants.objects.bulk_create(
+            [
+                Plants(name=f"plant {n}", owner=self.nursery, plant_description="d", price=Decimal(n + 1))
+                for n in range(20)
+            ]
+        )
+
+    def checkout(self, lines):
+        buyer = Buyer.objects.create(email=f"buyer{Buyer.objects.count()}@sales.test", password="x", first_name="B")
+        Cart.objects.bulk_create(
+            [Cart(plant=plant, user=buyer, quantity=2, total=plant.price * 2) for plant in self.plants[:lines]]
+        )
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {generate_token(buyer.id.urn, 'buyer')}")
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.post("/api/plants/checkout_cart/").json()
+        self.assertTrue(body["status"], body["message"])
+        return len(queries)
+
+    def test_checkout_queries_do_not_grow_with_the_cart(self):
+        counts = [self.checkout(lines) for lines in (1, 5, 20)]
+        self.assertEqual(counts, counts[:1] * 3)
+        rows = DailyPlantSales.objects.order_by("plant__price")
+        # the first plant was in all three carts, the rows written by the first checkouts were added to
+        self.assertEqual(list(rows.values_list("orders", flat=True)), [3] + [2] * 4 + [1] * 15)
+        self.assertEqual(rows[0].revenue, Decimal("6.00"))
+        self.assertEqual(rows[0].pending_orders, 3)
+
+    def test_change_to_an_order_missing_from_the_rollup_rebuilds_its_day(self):
+        buyer = Buyer.objects.create(email="buyer@rollup.test", password="x", first_name="B")
+        plant = self.plants[0]
+        # placed without going through the rollup, as before the last rebuild
+        (order,) = Order.objects.bulk_create(
+            [Order(plant=plant, buyer=buyer, nursery=self.nursery, quantity=2, total=plant.price * 2)]
+        )
+        Order.objects.filter(pk=order.pk).update(order_status=Order.CONFIRMED)
+        order.order_status = Order.CONFIRMED
+        with self.assertLogs(analytics.logger, "WARNING"):
+            analytics.record_order_changed(order, Order.PENDING, False)
+        row = DailyPlantSales.objects.get(plant=plant)
+        self.assertEqual((row.orders, row.pending_orders, row.confirmed_orders), (1, 0, 1))
+        self.assertEqual(row.revenue, plant.price * 2)
+
+    def test_summary_ranks_top_plants_per_day(self):
+        today = timezone.now().date()
+        yesterday = today - timezone.timedelta(days=1)
+        # revenue of a plant: its price on both days, times 3 today
+        DailyPlantSales.objects.bulk_create(
+            [
+                DailyPlantSales(
+                    nursery=self.nursery, plant=plant, day=day, orders=1, quantity=1, revenue=plant.price * factor
+                )
+                for plant in self.plants[:8]
+                for day, factor in ((yesterday, 1), (today, 3))
+            ]
+        )
+        summary = analytics.sales_summary(self.nursery.id, yesterday, today)
+        self.assertEqual([day["day"] for day in summary], [yesterday, today])
+        for day, factor in zip(summary, (1, 3)):
+            self.assertEqual(day["orders"], 8)
+            self.assertEqual(
+                [(plant["plant_name"], plant["revenue"]) for plant in day["top_plants"]],
+                [(f"plant {n}", Decimal(n + 1) * factor) for n in (7, 6, 5, 4, 3)],
+            )
+
+
+class FlakyStorage(FileSystemStorage):
+    """fails the saves numbered in `failing`, counting from 1"""
+
+    def __init__(self, failing=(), **kwargs):
+        super().__init__(**kwargs)
+        self.failing = set(failing)
+        self.saves = 0
+
+    def _save(self, name, content):
+        self.saves += 1
+        if self.saves in self.failing:
+            raise ConnectionError("storage unavailable")
+        return super()._save(name, content)
+
+
+class ImageProcessingTests(APITestCase):
+    def setUp(self):
+        nursery = Nursery.objects.create(email="nursery@images.test", password="x", name="N", about="a")
+        self.plant = Plants.objects.create(name="fern", owner=nursery, plant_description="d", price=Decimal("5.00"))
+        self.staging = FileSystemStorage(location=self.temporary_dir())
+        self.media = self.temporary_dir()
+        for patch in (
+            mock.patch.object(images, "image_staging_storage", return_value=self.staging),
+            mock.patch.object(images, "RETRY_BACKOFF", 0),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def temporary_dir(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return directory.name
+
+    def stage(self, content):
+        name = self.staging.save(f"{self.plant.id}/upload.png", ContentFile(content))
+        Plants.objects.filter(pk=self.plant.pk).update(image_staged=name, image_status=Plants.IMAGE_PENDING)
+        return name
+
+    def png(self):
+        buf = BytesIO()
+        Image.new("RGB", (40, 30), "green").save(buf, "PNG")
+        return buf.getvalue()
+
+    def process(self, storage):
+        with mock.patch.object(images, "image_storage", return_value=storage), self.assertLogs(images.logger) as logs:
+            status = images.process_image(self.plant.id)
+        return status, logs.records
+
+    def test_storage_errors_are_retried(self):
+        staged = self.stage(self.png())
+        # the second size fails on the first two attempts, every attempt starts over
+        storage = FlakyStorage(failing=(2, 4), location=self.media)
+        status, records = self.process(storage)
+        self.assertEqual(status, Plants.IMAGE_READY)
+        self.assertEqual(len(records), 2)
+        plant = Plants.objects.get(pk=self.plant.pk)
+        self.assertEqual(set(plant.image_variants), set(images.IMAGE_SIZES))
+        # the sizes saved by failed attempts were removed
+        saved = storage.listdir(f"files/plants/images/user_{self.plant.id}")[1]
+        self.assertEqual(sorted(saved), sorted(name.rsplit("/", 1)[1] for name in plant.image_variants.values()))
+        self.assertFalse(self.staging.exists(staged))
+
+    def test_failed_after_the_last_retry(self):
+        staged = self.stage(self.png())
+        storage = FlakyStorage(failing=range(1, images.RETRIES + 2), location=self.media)
+        with mock.patch.object(images, "_delete", wraps=images._delete) as delete:
+            status, records = self.process(storage)
+        self.assertEqual(status, Plants.IMAGE_FAILED)
+        self.assertEqual(len(records), images.RETRIES + 1)
+        # the staged file stayed for every retry and went with the final failure
+        self.assertEqual(delete.call_args_list[-1], mock.call(self.staging, [staged]))
+        self.assertFalse(self.staging.exists(staged))
+        self.assertEqual(Plants.objects.get(pk=self.plant.pk).image_status, Plants.IMAGE_FAILED)
+
+    def test_not_an_image_fails_without_retries(self):
+        self.stage(b"not an image")
+        status, records = self.process(FlakyStorage(location=self.media))
+        self.assertEqual(status, Plants.IMAGE_FAILED)
+        self.assertEqual([record.levelname for record in records], ["ERROR"])
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHER)
+class QueryBudgetTests(APITransactionTestCase):
+    """
+    each plants route within its view's query_budget and without N+1 queries, on a small seeded dataset with cold
+    caches; a transaction test case so the catalog version bumps after a commit are counted. Any database but
+    search, which needs PostgreSQL.
+    """
+
+    def test_routes_within_budget(self):
+        benchmark.seed(nurseries=2, plants=30, buyers=2, carts=3, orders=10, password="bench-password", days=3)
+        ctx = benchmark.Context("bench-password")
+        for scenario in benchmark.PLANT_SCENARIOS:
+            with self.subTest(scenario.name):
+                if scenario.name.startswith("search_plants") and connection.vendor != "postgresql":
+                    self.skipTest("search_plants needs PostgreSQL")
+                benchmark.clear_caches()
+                _, _, problems = benchmark.check_budget(self.client, ctx, scenario)
+                if problems:
+                    self.fail("\n".join(line for lines in problems for line in lines))
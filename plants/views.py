@@ -1,17 +1,38 @@
+from datetime import timedelta
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import IntegrityError, transaction
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import status as stat_code
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 
+from common_utils.async_views import AsyncAPIViewMixin
+from common_utils.conditional import get_validators, not_modified, set_validators, version_validators
 from common_utils.custom_auth import TokenAuthentication, generate_token
+from common_utils.pagination import KeysetPaginator
 from common_utils.permissions import IsNurseryUser, IsBuyerUser
-from common_utils.response import response
+from common_utils.response import response, stream_response, wants_stream, STREAM_CHUNK_SIZE
 
+from . import analytics, catalog_cache
+from .filters import plant_listing
+from .images import stage_image
+from .ingest import ingest_plants, parse_upload
 from .models import Plants, Cart, Order
-from .serializers import PlantsSerializer, PlantCartSerializer, PlantOrderSerializer, PlantsUpdateSerializer
+from .projections import CART_LIST, ORDER_LIST, PLANT_DETAIL, PLANT_LIST
+from .pricing import reprice_carts
+from .serializers import PlantCartSerializer, PlantOrderSerializer, PlantsUpdateSerializer
+
+# order lists embed the plant, its nursery and the buyer, an edit to any of them has to change the validators
+ORDER_STAMPS = ("updated_at", "plant__updated_at", "plant__owner__updated_at", "buyer__updated_at")
+
 
 # Create your views here.
-class PostListPlantsApiView(APIView):
+class PostListPlantsApiView(AsyncAPIViewMixin, APIView):
     """
     post:
     Use nursery user token.
@@ -22,27 +43,32 @@ class PostListPlantsApiView(APIView):
         "price": 250 (upto to 2 decimals),
         "inStock": true (bool)
     }
+    send as multipart with a "plant_images" file to attach an image, it is resized in the background
 
     get:
     Use nursery user token.
     returns list of plants posted by the requesting user
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
+    pass ?stream=true to stream the complete list instead of a page
     """
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsNurseryUser,)
+    query_budget = {"post": 5, "get": 2}
 
     def post(self, request):
         try:
-            if "plant_images" not in request.data:
-                request.data["plant_images"] = None
-            instances = Plants.objects.create(
-                name=request.data["name"],
-                owner_id=request.user.id,
-                plant_images=request.data["plant_images"],
-                plant_description=request.data["plant_description"],
-                price=request.data["price"],
-                inStock=request.data["inStock"],
-            )
+            with transaction.atomic():
+                instances = Plants.objects.create(
+                    name=request.data["name"],
+                    owner_id=request.user.id,
+                    plant_description=request.data["plant_description"],
+                    price=request.data["price"],
+                    inStock=request.data["inStock"],
+                )
+                if request.FILES.get("plant_images"):
+                    stage_image(instances.id, request.FILES["plant_images"])
             return response(
                 status_code=stat_code.HTTP_200_OK,
                 status=True,
@@ -53,76 +79,179 @@ class PostListPlantsApiView(APIView):
 
     def get(self, request):
         try:
-            instance = Plants.objects.filter(owner_id=request.user.id).select_related("owner").exclude(isDeleted=True)
-            vals = []
-            for i in instance.iterator():
-                try:
-                    img_url = i.plant_images.url
-                except Exception as e:
-                    img_url = None
-                _parse = {
-                    "id": i.id,
-                    "name": i.name,
-                    "owner_id": i.owner_id,
-                    "owner_name": i.owner.name,
-                    "owner_email": i.owner.email,
-                    "plant_images": img_url,
-                    "plant_description": i.plant_description,
-                    "price": i.price,
-                    "inStock": i.inStock,
-                }
-                vals.append(_parse)
+            projection, paginator = PLANT_LIST.for_request(request), KeysetPaginator("created_at")
+            instance = projection.query(
+                Plants.objects.filter(owner_id=request.user.id, isDeleted=False), *paginator.keys
+            )
+            if wants_stream(request):
+                rows = paginator.stream(instance, STREAM_CHUNK_SIZE)
+                return stream_response(
+                    status_code=stat_code.HTTP_200_OK,
+                    status=True,
+                    msg="Retreived list of plants.",
+                    rows=projection.iter_rows(rows),
+                )
+            rows, paging = paginator.paginate(request, instance)
+            vals = projection.rows(rows)
             return response(
                 status_code=stat_code.HTTP_200_OK,
                 status=True,
                 msg="Retreived list of plants.",
                 data=vals,
+                paging=paging,
             )
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
 
-class ListPlantsApiView(APIView):
+class BulkUploadPlantsApiView(APIView):
+    """
+    post:
+    Use nursery user token.
+    add plants in bulk, the body is read as a stream and written in batches
+    Content-Type: application/json -> array of
+    {
+        "name": "plant name",
+        "plant_description": "lorem ipsum",
+        "price": 250 (upto to 2 decimals),
+        "inStock": true (bool),
+        "sku": "A-1" (optional)
+    }
+    Content-Type: application/x-ndjson -> one such object per line
+    Content-Type: text/csv -> header row name,plant_description,price,inStock,sku
+    rows with an existing sku are rejected unless ?mode=upsert, which updates them instead
+    the sku of a deleted plant is free again, its row creates a new plant
+    returns created / updated / failed counts and errors by row number
+    """
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsNurseryUser,)
+    query_budget = {"post": 5}
+
+    def post(self, request):
+        try:
+            rows = parse_upload(request.content_type, request.stream)
+            if rows is None:
+                return response(
+                    status_code=stat_code.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                    status=False,
+                    msg="Use application/json, application/x-ndjson or text/csv.",
+                )
+            result = ingest_plants(request.user.id, rows, upsert=request.query_params.get("mode") == "upsert")
+            return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Bulk upload processed.", data=result)
+        except Exception as e:
+            return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
+
+
+class ListPlantsApiView(AsyncAPIViewMixin, APIView):
     """
     get:
     use nursery/buyer user token.
     returns list of all plants for both buyers and nurseries
+    pages are served from the catalog cache until a plant or nursery changes
+    send back ETag / Last-Modified as If-None-Match / If-Modified-Since to get a 304 when nothing changed
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
+    pass ?stream=true to stream the complete list instead of a page
+    sort with ?sort=created (default) / newest / price / -price / name / -name
+    filter with ?nursery=<id>, ?inStock=true, ?min_price= / ?max_price= (sort by price)
+    and ?created_after= (sort by created / newest), other combinations are rejected
     """
 
     authentication_classes = (TokenAuthentication,)
+    query_budget = {"get": 3}
 
     def get(self, request):
         try:
-            instances = Plants.objects.select_related("owner").all().exclude(isDeleted=True)
-            vals = []
-            for i in instances.iterator():
-                try:
-                    img_url = i.plant_images.url
-                except Exception as e:
-                    img_url = None
-                _parse = {
-                    "id": i.id,
-                    "name": i.name,
-                    "owner_id": i.owner_id,
-                    "owner_name": i.owner.name,
-                    "owner_email": i.owner.email,
-                    "plant_images": img_url,
-                    "plant_description": i.plant_description,
-                    "price": i.price,
-                    "inStock": i.inStock,
-                }
-                vals.append(_parse)
+            instances, paginator = plant_listing(request, Plants.objects.filter(isDeleted=False))
+            projection = PLANT_LIST.for_request(request)
+            plant_rows = projection.query(instances, *paginator.keys)
+            # validators and cached pages both come from the catalog version, checked before any query: a 304
+            # or a cached page runs none while this process's copy of the version is fresh (VERSION_TTL).
+            # Without a shared version neither is offered.
+            version = catalog_cache.get_version() if catalog_cache.enabled() else None
+            etag = last_modified = cache_key = page = None
+            if version is not None:
+                etag, last_modified = version_validators(request, version)
+                unchanged = not_modified(request, etag, last_modified)
+                if unchanged is not None:
+                    return unchanged
+            if wants_stream(request):
+                rows = paginator.stream(plant_rows, STREAM_CHUNK_SIZE)
+                resp = stream_response(
+                    status_code=stat_code.HTTP_200_OK,
+                    status=True,
+                    msg="Retreived list of plants.",
+                    rows=projection.iter_rows(rows),
+                )
+                return set_validators(resp, etag, last_modified)
+            if version is not None:
+                cache_key = catalog_cache.page_key(request, version)
+                page = catalog_cache.get_page(cache_key)
+            if page is None:
+                rows, paging = paginator.paginate(request, plant_rows)
+                page = {"data": projection.rows(rows), "paging": paging}
+                if cache_key is not None:
+                    catalog_cache.set_page(cache_key, page)
+            resp = response(
+                status_code=stat_code.HTTP_200_OK,
+                status=True,
+                msg="Retreived list of plants.",
+                data=page["data"],
+                paging=page["paging"],
+            )
+            return set_validators(resp, etag, last_modified)
+        except Exception as e:
+            return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
+
+
+class SearchPlantsApiView(AsyncAPIViewMixin, APIView):
+    """
+    get:
+    use nursery/buyer user token.
+    full text search over plant name and description, best matches first
+    ?q=<search text> (required)
+    misspelt plant names still match through trigram similarity
+    out of stock plants are left out unless ?include_out_of_stock=true
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
+    """
+
+    authentication_classes = (TokenAuthentication,)
+    query_budget = {"get": 2}
+
+    def get(self, request):
+        try:
+            text = request.query_params.get("q", "").strip()
+            if not text:
+                return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="q is required.")
+            query = SearchQuery(text, search_type="websearch", config="english")
+            instances = (
+                Plants.objects.exclude(isDeleted=True)
+                .filter(Q(search_vector=query) | Q(name__trigram_similar=text))
+                # ranks are single precision, the cursor keeps a double: compare both as double so the
+                # page boundary matches exactly
+                .annotate(
+                    score=Cast(SearchRank(F("search_vector"), query) + TrigramSimilarity("name", text), FloatField())
+                )
+            )
+            if request.query_params.get("include_out_of_stock", "").lower() not in ("1", "true", "yes"):
+                instances = instances.filter(inStock=True)
+            projection, paginator = PLANT_LIST.for_request(request), KeysetPaginator("score", descending=True)
+            rows, paging = paginator.paginate(request, projection.query(instances, *paginator.keys))
+            vals = projection.rows(rows)
             return response(
                 status_code=stat_code.HTTP_200_OK,
                 status=True,
                 msg="Retreived list of plants.",
                 data=vals,
+                paging=paging,
             )
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
 
-class RetreiveUpdateDeletePlantsApiView(APIView):
+class RetreiveUpdateDeletePlantsApiView(AsyncAPIViewMixin, APIView):
     """
     get:
     use nursery user token.
@@ -138,6 +267,7 @@ class RetreiveUpdateDeletePlantsApiView(APIView):
         "inStock": false,
         "isDeleted": false
     }
+    send as multipart with a "plant_images" file to replace the image
 
     delete:
     use nursery user token
@@ -146,11 +276,13 @@ class RetreiveUpdateDeletePlantsApiView(APIView):
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsNurseryUser,)
+    query_budget = {"get": 2, "put": 6, "delete": 5}
 
     def get(self, request, plant_id):
         try:
-            plant_instance = Plants.objects.exclude(isDeleted=True).get(id=plant_id, owner_id=request.user.id)
-            serialized = PlantsSerializer(plant_instance).data
+            serialized = PLANT_DETAIL.get(
+                Plants.objects.exclude(isDeleted=True).filter(id=plant_id, owner_id=request.user.id)
+            )
             return response(
                 status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived successfully.", data=serialized
             )
@@ -168,7 +300,12 @@ class RetreiveUpdateDeletePlantsApiView(APIView):
                 plant_instance, request.data, partial=True
             )  # accepts partial update
             if serializer_class.is_valid(raise_exception=True):
-                serializer_class.save()
+                with transaction.atomic():
+                    serializer_class.save()
+                    if "price" in serializer_class.validated_data:
+                        reprice_carts([plant_instance.id])
+                    if request.FILES.get("plant_images"):
+                        stage_image(plant_instance.id, request.FILES["plant_images"])
                 data = serializer_class.data
                 return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Updated successfully.", data=data)
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=serializer_class.errors)
@@ -179,7 +316,10 @@ class RetreiveUpdateDeletePlantsApiView(APIView):
 
     def delete(self, request, plant_id):
         try:
-            plant_instance = Plants.objects.filter(id=plant_id, owner_id=request.user.id).update(isDeleted=True)
+            plant_instance = Plants.objects.filter(id=plant_id, owner_id=request.user.id).update(
+                isDeleted=True, updated_at=timezone.now()
+            )
+            catalog_cache.catalog_changed.send(sender=Plants)
             return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Deletion successfuly.")
         except Plants.DoesNotExist as ude:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Plant does not exist.")
@@ -187,7 +327,7 @@ class RetreiveUpdateDeletePlantsApiView(APIView):
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
 
-class AddGetCartApiView(APIView):
+class AddGetCartApiView(AsyncAPIViewMixin, APIView):
     """
     post:
     add to cart
@@ -197,10 +337,14 @@ class AddGetCartApiView(APIView):
     get:
     receive cart of a buyer
     use buyer user token
+    send back ETag / Last-Modified as If-None-Match / If-Modified-Since to get a 304 when nothing changed
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
     """
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsBuyerUser,)
+    query_budget = {"post": 4, "get": 3}
 
     def post(self, request):
         try:
@@ -214,7 +358,6 @@ class AddGetCartApiView(APIView):
                 )  # accepts partial update
                 if serializer_class.is_valid(raise_exception=True):
                     serializer_class.save()
-                    serialized = serializer_class.data
                     return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Updated Cart.")
                 return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=serializer_class.errors)
             except Cart.DoesNotExist as cde:
@@ -223,28 +366,31 @@ class AddGetCartApiView(APIView):
                 )
                 serialized = PlantCartSerializer(add_to_cart).data
                 return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Added to Cart.", data=serialized)
-        except Plants.DoesNotExist as ude:
+        except (Plants.DoesNotExist, IntegrityError) as ude:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Plant does not exist.")
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
     def get(self, request):
         try:
-            cart_values = (
-                Cart.objects.filter(user_id=request.user.id)
-                .select_related("buyer", "plant")
-                .values(
-                    "id",
-                    "plant_id",
-                    "plant__name",
-                    "plant__owner_id",
-                    "plant__owner__name",
-                    "plant__owner__email",
-                    "total",
-                    "created_at",
-                )
+            etag, last_modified = get_validators(
+                request,
+                Cart.objects.filter(user_id=request.user.id),
+                "updated_at",
+                "plant__updated_at",
+                "plant__owner__updated_at",
             )
-            return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived Cart.", data=cart_values)
+            unchanged = not_modified(request, etag, last_modified)
+            if unchanged is not None:
+                return unchanged
+            projection, paginator = CART_LIST.for_request(request), KeysetPaginator("created_at")
+            cart_values = projection.query(Cart.objects.filter(user_id=request.user.id), *paginator.keys)
+            rows, paging = paginator.paginate(request, cart_values)
+            cart_values = projection.rows(rows)
+            resp = response(
+                status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived Cart.", data=cart_values, paging=paging
+            )
+            return set_validators(resp, etag, last_modified)
         except Cart.DoesNotExist as cde:
             return response(
                 status_code=stat_code.HTTP_403_FORBIDDEN,
@@ -264,6 +410,7 @@ class DeleteCartApiView(APIView):
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsBuyerUser,)
+    query_budget = {"delete": 2}
 
     def delete(self, request, cart_id):
         try:
@@ -279,7 +426,7 @@ class DeleteCartApiView(APIView):
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
 
-class AddGetOrderApiView(APIView):
+class AddGetOrderApiView(AsyncAPIViewMixin, APIView):
     """
     post:
     place an order
@@ -288,18 +435,25 @@ class AddGetOrderApiView(APIView):
     get:
     list of all orders placed
     use buyer user token
+    send back ETag / Last-Modified as If-None-Match / If-Modified-Since to get a 304 when nothing changed
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
+    pass ?stream=true to stream the complete list instead of a page
     """
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsBuyerUser,)
+    query_budget = {"post": 6, "get": 3}
 
     def post(self, request):
         try:
-            place_order = Order.objects.create(
-                plant_id=request.data["plant_id"], buyer_id=request.user.id, quantity=request.data["quantity"]
-            )
+            with transaction.atomic():
+                place_order = Order.objects.create(
+                    plant_id=request.data["plant_id"], buyer_id=request.user.id, quantity=request.data["quantity"]
+                )
+                analytics.record_order_placed(place_order)
             return response(status_code=stat_code.HTTP_200_OK, status=True, msg="New Order Placed successfully.")
-        except Plants.DoesNotExist as cde:
+        except (Plants.DoesNotExist, IntegrityError) as cde:
             return response(
                 status_code=stat_code.HTTP_403_FORBIDDEN,
                 status=False,
@@ -310,67 +464,138 @@ class AddGetOrderApiView(APIView):
 
     def get(self, request):
         try:
-            order_vals = (
-                Order.objects.filter(buyer_id=request.user.id)
-                .select_related("buyer", "plant")
-                .values(
-                    "id",
-                    "buyer_id",
-                    "buyer__first_name",
-                    "buyer__email",
-                    "plant_id",
-                    "plant__name",
-                    "plant__owner_id",
-                    "plant__owner__name",
-                    "plant__owner__email",
-                    "total",
-                    "is_payed",
-                    "order_status",
-                    "ordered_at",
+            etag, last_modified = get_validators(request, Order.objects.filter(buyer_id=request.user.id), *ORDER_STAMPS)
+            unchanged = not_modified(request, etag, last_modified)
+            if unchanged is not None:
+                return unchanged
+            projection, paginator = ORDER_LIST.for_request(request), KeysetPaginator("ordered_at")
+            order_vals = projection.query(Order.objects.filter(buyer_id=request.user.id), *paginator.keys)
+            if wants_stream(request):
+                resp = stream_response(
+                    status_code=stat_code.HTTP_200_OK,
+                    status=True,
+                    msg="Retreived order list(s).",
+                    rows=projection.iter_rows(paginator.stream(order_vals, STREAM_CHUNK_SIZE)),
                 )
+                return set_validators(resp, etag, last_modified)
+            rows, paging = paginator.paginate(request, order_vals)
+            order_vals = projection.rows(rows)
+            resp = response(
+                status_code=stat_code.HTTP_200_OK,
+                status=True,
+                msg="Retreived order list(s).",
+                data=order_vals,
+                paging=paging,
             )
-            return response(
-                status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived order list(s).", data=order_vals
-            )
+            return set_validators(resp, etag, last_modified)
+        except Exception as e:
+            return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
+
+
+class CheckoutCartApiView(APIView):
+    """
+    post:
+    place orders for everything in the cart and empty it, all or nothing
+    use buyer user token
+    returns the new order ids and the grand total
+    """
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsBuyerUser,)
+    query_budget = {"post": 5}
+
+    def post(self, request):
+        try:
+            with transaction.atomic():
+                # one query for the whole cart, prices come from the same join; rows stay locked until commit
+                lines = list(
+                    Cart.objects.select_for_update(of=("self",))
+                    .filter(user_id=request.user.id)
+                    .values_list(
+                        "id",
+                        "plant_id",
+                        "plant__owner_id",
+                        "quantity",
+                        "plant__price",
+                        "plant__isDeleted",
+                        "plant__inStock",
+                    )
+                )
+                if not lines:
+                    return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Cart is empty.")
+                unavailable = [plant_id for _, plant_id, _, _, _, deleted, in_stock in lines if deleted or not in_stock]
+                if unavailable:
+                    return response(
+                        status_code=stat_code.HTTP_403_FORBIDDEN,
+                        status=False,
+                        msg="Some plants in the cart are no longer available.",
+                        data=unavailable,
+                    )
+                orders = Order.objects.bulk_create(
+                    [
+                        Order(
+                            plant_id=plant_id,
+                            buyer_id=request.user.id,
+                            nursery_id=nursery_id,
+                            quantity=quantity,
+                            total=price * quantity,
+                        )
+                        for _, plant_id, nursery_id, quantity, price, _, _ in lines
+                    ]
+                )
+                analytics.record_orders_placed(orders)
+                Cart.objects.filter(id__in=[cart_id for cart_id, *_ in lines]).delete()
+            data = {"orders": [order.id for order in orders], "total": sum(order.total for order in orders)}
+            return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Order(s) placed successfully.", data=data)
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
 
-class NurseryViewOrdersApiView(APIView):
+class NurseryViewOrdersApiView(AsyncAPIViewMixin, APIView):
     """
     get:
-    list of all orders placed
+    list of all orders received, newest first
     use nursery user token
+    send back ETag / Last-Modified as If-None-Match / If-Modified-Since to get a 304 when nothing changed
+    paginated, pass ?limit= and the ?cursor= from paging.next / paging.prev
+    pass ?fields=id,name,... to get only those fields
+    pass ?stream=true to stream the complete list instead of a page
     """
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsNurseryUser,)
+    query_budget = {"get": 3}
 
     def get(self, request):
         try:
-            order_vals = (
-                Order.objects.filter(plant__owner_id=request.user.id)
-                .select_related("plant", "buyer")
-                .order_by("-ordered_at")
-                .values(
-                    "id",
-                    "buyer_id",
-                    "buyer__first_name",
-                    "buyer__email",
-                    "plant_id",
-                    "plant__name",
-                    "plant__owner_id",
-                    "plant__owner__name",
-                    "plant__owner__email",
-                    "total",
-                    "is_payed",
-                    "order_status",
-                    "ordered_at",
-                )
+            etag, last_modified = get_validators(
+                request,
+                Order.objects.filter(nursery_id=request.user.id),
+                *ORDER_STAMPS,
             )
-            return response(
-                status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived order list(s).", data=order_vals
+            unchanged = not_modified(request, etag, last_modified)
+            if unchanged is not None:
+                return unchanged
+            projection, paginator = ORDER_LIST.for_request(request), KeysetPaginator("ordered_at", descending=True)
+            order_vals = projection.query(Order.objects.filter(nursery_id=request.user.id), *paginator.keys)
+            if wants_stream(request):
+                resp = stream_response(
+                    status_code=stat_code.HTTP_200_OK,
+                    status=True,
+                    msg="Retreived order list(s).",
+                    rows=projection.iter_rows(paginator.stream(order_vals, STREAM_CHUNK_SIZE)),
+                )
+                return set_validators(resp, etag, last_modified)
+            rows, paging = paginator.paginate(request, order_vals)
+            order_vals = projection.rows(rows)
+            resp = response(
+                status_code=stat_code.HTTP_200_OK,
+                status=True,
+                msg="Retreived order list(s).",
+                data=order_vals,
+                paging=paging,
             )
+            return set_validators(resp, etag, last_modified)
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
@@ -393,6 +618,7 @@ class UpdateOrderStatusApiView(APIView):
 
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsNurseryUser,)
+    query_budget = {"put": 4}
 
     def put(self, request, order_id):
         try:
@@ -401,16 +627,19 @@ class UpdateOrderStatusApiView(APIView):
                 _ord_stat["order_status"] = request.data["order_status"]
             if "is_payed" in request.data:
                 _ord_stat["is_payed"] = request.data["is_payed"]
-            order_instance = Order.objects.get(pk=order_id)
-            if order_instance.plant.owner.id != request.user.id:
-                return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Invalid order id")
-            serializer_class = PlantOrderSerializer(order_instance, _ord_stat, partial=True)
-            if serializer_class.is_valid(raise_exception=True):
-                serializer_class.save()
-                serialized = serializer_class.data
-                return response(
-                    status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived order details.", data=serialized
-                )
+            with transaction.atomic():
+                order_instance = Order.objects.select_for_update().get(pk=order_id)
+                if order_instance.nursery_id != request.user.id:
+                    return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Invalid order id")
+                old_status, old_is_payed = order_instance.order_status, order_instance.is_payed
+                serializer_class = PlantOrderSerializer(order_instance, _ord_stat, partial=True)
+                if serializer_class.is_valid(raise_exception=True):
+                    serializer_class.save()
+                    analytics.record_order_changed(order_instance, old_status, old_is_payed)
+                    serialized = serializer_class.data
+                    return response(
+                        status_code=stat_code.HTTP_200_OK, status=True, msg="Retreived order details.", data=serialized
+                    )
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=serializer_class.errors)
         except Order.DoesNotExist as ode:
             return response(
@@ -418,3 +647,41 @@ class UpdateOrderStatusApiView(APIView):
             )
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
+
+
+class NurserySalesAnalyticsApiView(APIView):
+    """
+    get:
+    daily sales of the nursery: orders, quantity, revenue, paid revenue, order counts per status
+    and the top plants by revenue for each day
+    use nursery user token
+    pass ?from=YYYY-MM-DD&to=YYYY-MM-DD, defaults to the last 30 days, at most 366 days per request
+    """
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsNurseryUser,)
+    query_budget = {"get": 3}
+
+    def get(self, request):
+        try:
+            today = timezone.now().date()
+            date_to = parse_date(request.query_params.get("to") or today.isoformat())
+            date_from = parse_date(request.query_params.get("from") or (date_to - timedelta(days=29)).isoformat())
+            if date_from is None or date_to is None or date_from > date_to:
+                return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Invalid date range.")
+            if (date_to - date_from).days > 365:
+                return response(
+                    status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Date range can be at most 366 days."
+                )
+            data = analytics.sales_summary(request.user.id, date_from, date_to)
+            return response(
+                status_code=stat_code.HTTP_200_OK,
+                status=True,
+                msg="Retreived sales analytics.",
+                data=data,
+                range={"from": date_from, "to": date_to},
+            )
+        except ValueError:
+            return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="Invalid date range.")
+        except Exception as e:
+            return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
@@ -85,6 +85,8 @@ class Nursery(models.Model):
     isdeleted = models.BooleanField(_("User deleted"), default=False, db_index=True)
 
     created_at = models.DateTimeField(default=timezone.now)
+    # stamps the order / cart lists that show the nursery name and email (common_utils.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.email
@@ -105,6 +107,8 @@ class Buyer(models.Model):
     isdeleted = models.BooleanField(_("User deleted"), default=False, db_index=True)
 
     created_at = models.DateTimeField(default=timezone.now)
+    # stamps the order lists that show the buyer name and email (common_utils.conditional)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def get_full_name(self):
         return f"{self.first_name}  {self.middle_name}   {self.last_name}"
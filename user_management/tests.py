@@ -1,3 +1,122 @@
-from django.test import TestCase
+import uuid
+from unittest import mock
 
-# Create your tests here.
+from django.test import override_settings
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from common_utils.custom_auth import PrincipalCache, TokenAuthentication, generate_token, principal_cache
+
+from common_utils.revocation import RevocationSet, revocations
+from common_utils.shared_cache import shared_cache
+from plants import benchmark
+
+from .models import Buyer
+
+FAST_HASHER = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHER)
+class UnknownEmailTests(APITestCase):
+    credentials = {"email": "new@buyer.test", "password": "secret"}
+
+    def tearDown(self):
+        shared_cache().clear()
+
+    def login(self):
+        return self.client.post("/api/auth/login_buyer/", self.credentials, format="json").json()["status"]
+
+    def register(self):
+        body = dict(self.credentials, first_name="New")
+        self.assertTrue(self.client.post("/api/auth/register_buyer/", body, format="json").json()["status"])
+
+    def test_database_cache_keeps_no_negative_entries(self):
+        # the default "shared" alias is the database table, an entry would cost more queries than it saves
+        with self.assertNumQueries(1):
+            self.assertFalse(self.login())
+        self.register()
+        self.assertTrue(self.login())
+
+    def test_shared_store_remembers_unknown_emails_until_registration(self):
+        with mock.patch("common_utils.hashing.saves_queries", return_value=True):
+            self.assertFalse(self.login())
+            # the repeat is answered from the shared cache, no query for the buyer
+            with self.assertNumQueries(1):
+                self.assertFalse(self.login())
+            self.register()
+            self.assertTrue(self.login())
+
+
+class RevocationTests(APITestCase):
+    def setUp(self):
+        self.user_id = uuid.uuid4()
+        self.revoked_here, self.other_process = RevocationSet(), RevocationSet()
+        for revocations in (self.revoked_here, self.other_process):
+            revocations.load()
+
+    def tearDown(self):
+        shared_cache().clear()
+
+    def test_database_cache_is_not_read_per_request(self):
+        self.revoked_here.revoke(self.user_id)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.revoked_here.is_revoked(self.user_id))
+            # the other process rejects the user after its next reload
+            self.assertFalse(self.other_process.is_revoked(self.user_id))
+
+    def test_shared_store_reaches_other_processes_at_once(self):
+        with mock.patch("common_utils.revocation.saves_queries", return_value=True):
+            self.revoked_here.revoke(self.user_id)
+            self.assertTrue(self.other_process.is_revoked(self.user_id))
+            self.assertFalse(self.other_process.is_revoked(uuid.uuid4()))
+
+
+class PrincipalCacheTests(APITestCase):
+    def setUp(self):
+        self.buyer = Buyer.objects.create(email="buyer@principal.test", password="x", first_name="B")
+        self.token = generate_token(self.buyer.id.urn, "buyer")
+        principal_cache.clear()
+        revocations.load()
+
+    def tearDown(self):
+        principal_cache.clear()
+        shared_cache().clear()
+
+    def authenticate(self):
+        return TokenAuthentication().authenticate_credentials(self.token)[0]
+
+    def test_hits_are_copies(self):
+        self.authenticate().first_name = "changed by a request"
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate().first_name, "B")
+        self.assertIsNot(self.authenticate(), self.authenticate())
+
+    def test_user_deleted_by_another_process_is_rejected_from_the_cache(self):
+        self.authenticate()
+        # the deleting process invalidates its own cache, this one only sees the revocation reload
+        Buyer.objects.filter(pk=self.buyer.pk).update(isdeleted=True)
+        revocations.load()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_shared_generation_drops_entries_of_other_processes(self):
+        with mock.patch("common_utils.custom_auth.saves_queries", return_value=True):
+            self.authenticate()
+            Buyer.objects.filter(pk=self.buyer.pk).update(first_name="Renamed")
+            PrincipalCache().invalidate(self.buyer.id)
+            self.assertEqual(self.authenticate().first_name, "Renamed")
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHER)
+class QueryBudgetTests(APITransactionTestCase):
+    """each account route within its view's query_budget and without N+1 queries, with cold caches"""
+
+    def test_routes_within_budget(self):
+        benchmark.seed(nurseries=1, plants=5, buyers=1, carts=1, orders=2, password="bench-password", days=1)
+        ctx = benchmark.Context("bench-password")
+        for scenario in benchmark.USER_SCENARIOS:
+            with self.subTest(scenario.name):
+                benchmark.clear_caches()
+                _, _, problems = benchmark.check_budget(self.client, ctx, scenario)
+                if problems:
+                    self.fail("\n".join(line for lines in problems for line in lines))
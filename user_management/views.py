@@ -3,16 +3,20 @@ from functools import partial
 
 import jwt
 from django.conf import settings
-from django.contrib.auth.hashers import check_password, make_password
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import status as stat_code
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 
-from common_utils.custom_auth import TokenAuthentication, generate_token
+from common_utils.custom_auth import TokenAuthentication, generate_token, principal_cache
+from common_utils.hashing import HashingBusy, authenticate, forget_unknown_email, password_hasher
 from common_utils.permissions import IsNurseryUser, IsBuyerUser
 from common_utils.response import response
+from common_utils.revocation import revocations
+from plants.catalog_cache import catalog_changed
+from plants.models import Plants
 
 from .models import Nursery, Buyer
 from .serializers import BuyerSerializer, NurserySerializer
@@ -34,6 +38,7 @@ class BuyerRegisterationApiView(APIView):
 
     permission_classes = (AllowAny,)
     serializer_class = BuyerSerializer
+    query_budget = {"post": 1}
 
     def post(self, request):
         try:
@@ -43,11 +48,12 @@ class BuyerRegisterationApiView(APIView):
                 request.data["last_name"] = ""
             user = Buyer.objects.create(
                 email=request.data["email"],
-                password=make_password(request.data["password"]),
+                password=password_hasher.make_password(request.data["password"]),
                 first_name=request.data["first_name"],
                 middle_name=request.data["middle_name"],
                 last_name=request.data["last_name"],
             )
+            forget_unknown_email(Buyer, user.email)
             # Do no return user data on successful registration
             return response(status_code=stat_code.HTTP_200_OK, status=True, msg="User(Buyer) registered successfully.")
         except IntegrityError as ie:
@@ -56,6 +62,10 @@ class BuyerRegisterationApiView(APIView):
                 status=False,
                 msg="User(Buyer) with this email already exist.",
             )
+        except HashingBusy as hb:
+            resp = response(status_code=stat_code.HTTP_503_SERVICE_UNAVAILABLE, status=False, msg=str(hb))
+            resp["Retry-After"] = "1"
+            return resp
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
@@ -74,6 +84,7 @@ class NurseryRegisterationApiView(APIView):
 
     permission_classes = (AllowAny,)
     serializer_class = BuyerSerializer
+    query_budget = {"post": 1}
 
     def post(self, request):
         try:
@@ -81,10 +92,11 @@ class NurseryRegisterationApiView(APIView):
                 request.data["about"] = ""
             user = Nursery.objects.create(
                 email=request.data["email"],
-                password=make_password(request.data["password"]),
+                password=password_hasher.make_password(request.data["password"]),
                 name=request.data["name"],
                 about=request.data["about"],
             )
+            forget_unknown_email(Nursery, user.email)
             # Do no return user data on successful registration
             return response(
                 status_code=stat_code.HTTP_200_OK, status=True, msg="User(Nursery) registered successfully."
@@ -95,6 +107,10 @@ class NurseryRegisterationApiView(APIView):
                 status=False,
                 msg="User(Nursery) with this email exists.",
             )
+        except HashingBusy as hb:
+            resp = response(status_code=stat_code.HTTP_503_SERVICE_UNAVAILABLE, status=False, msg=str(hb))
+            resp["Retry-After"] = "1"
+            return resp
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
@@ -110,12 +126,12 @@ class BuyerLoginApiView(APIView):
     """
 
     permission_classes = (AllowAny,)
+    query_budget = {"post": 1}
 
     def post(self, request):
         try:
-            user = Buyer.objects.exclude(isdeleted=True).get(email=request.data["email"])
-            password_matched = check_password(request.data["password"], user.password)
-            if password_matched:
+            user = authenticate(Buyer, request.data["email"], request.data["password"])
+            if user is not None:
                 user_type = "buyer"
                 jwt_token = generate_token(user.id.urn, user_type)
                 data = {"user_id": user.id, "jwt_token": jwt_token}
@@ -127,6 +143,10 @@ class BuyerLoginApiView(APIView):
             )
         except Buyer.DoesNotExist as ude:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="User does not exist.")
+        except HashingBusy as hb:
+            resp = response(status_code=stat_code.HTTP_503_SERVICE_UNAVAILABLE, status=False, msg=str(hb))
+            resp["Retry-After"] = "1"
+            return resp
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
@@ -141,12 +161,12 @@ class NurseryLoginApiView(APIView):
     }
     """
 
+    query_budget = {"post": 1}
+
     def post(self, request):
         try:
-
-            user = Nursery.objects.exclude(isdeleted=True).get(email=request.data["email"])
-            password_matched = check_password(request.data["password"], user.password)
-            if password_matched:
+            user = authenticate(Nursery, request.data["email"], request.data["password"])
+            if user is not None:
                 user_type = "nursery"
                 jwt_token = generate_token(user.id.urn, user_type)
                 data = {"user_id": user.id, "jwt_token": jwt_token}
@@ -160,6 +180,10 @@ class NurseryLoginApiView(APIView):
             return response(
                 status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="User does not exist, maybe deleted ?"
             )
+        except HashingBusy as hb:
+            resp = response(status_code=stat_code.HTTP_503_SERVICE_UNAVAILABLE, status=False, msg=str(hb))
+            resp["Retry-After"] = "1"
+            return resp
         except Exception as e:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=str(e))
 
@@ -187,6 +211,7 @@ class BuyerRetreiveUpdateDeleteApiView(APIView):
     """
 
     authentication_classes = (TokenAuthentication,)
+    query_budget = {"get": 2, "put": 3, "delete": 2}
 
     def get(self, request):
         try:
@@ -216,6 +241,7 @@ class BuyerRetreiveUpdateDeleteApiView(APIView):
             serializer_class = BuyerSerializer(user, request.data, partial=True)  # accepts partial update
             if serializer_class.is_valid(raise_exception=True):
                 serializer_class.save()
+                principal_cache.invalidate(request.user.id)
                 data = serializer_class.data
                 return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Retrieved user data.", data=data)
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=serializer_class.errors)
@@ -235,6 +261,8 @@ class BuyerRetreiveUpdateDeleteApiView(APIView):
             user_delete = Buyer.objects.filter(pk=request.user.id).delete()
             """
             user_delete = Buyer.objects.filter(pk=request.user.id).update(isdeleted=True)
+            principal_cache.invalidate(request.user.id)
+            revocations.revoke(request.user.id)
             return response(status_code=stat_code.HTTP_200_OK, status=True, msg="User deleted successfully.")
         except Buyer.DoesNotExist as ude:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="User does not exist.")
@@ -258,11 +286,12 @@ class NurseryRetreiveUpdateDeleteApiView(APIView):
     delete:
     Delete requesting user profile
     Not exactly deleting from the database.
-    updating isDeleted = True.
+    updating isDeleted = True, the nursery's plants are marked deleted too.
     use nursery user token
     """
 
     authentication_classes = (TokenAuthentication,)
+    query_budget = {"get": 2, "put": 6, "delete": 6}
 
     def get(self, request):
         try:
@@ -296,6 +325,7 @@ class NurseryRetreiveUpdateDeleteApiView(APIView):
             serializer_class = NurserySerializer(user, request.data, partial=True)  # accepts partial update
             if serializer_class.is_valid(raise_exception=True):
                 serializer_class.save()
+                principal_cache.invalidate(request.user.id)
                 data = serializer_class.data
                 return response(status_code=stat_code.HTTP_200_OK, status=True, msg="Updated user data.", data=data)
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg=serializer_class.errors)
@@ -312,7 +342,16 @@ class NurseryRetreiveUpdateDeleteApiView(APIView):
 
             user_delete = Nursery.objects.filter(pk=request.user.id).delete()
             """
-            user_delete = Nursery.objects.filter(pk=request.user.id).update(isdeleted=True)
+            with transaction.atomic():
+                user_delete = Nursery.objects.filter(pk=request.user.id).update(isdeleted=True)
+                # its plants leave the catalog with it
+                Plants.objects.filter(owner_id=request.user.id, isDeleted=False).update(
+                    isDeleted=True, updated_at=timezone.now()
+                )
+            # update() sends no post_save, tell the catalog cache directly
+            catalog_changed.send(sender=Nursery)
+            principal_cache.invalidate(request.user.id)
+            revocations.revoke(request.user.id)
             return response(status_code=stat_code.HTTP_200_OK, status=True, msg="User deleted successfully.")
         except Nursery.DoesNotExist as ude:
             return response(status_code=stat_code.HTTP_403_FORBIDDEN, status=False, msg="User does not exist.")